@@ -4,29 +4,121 @@
 # Distributed under the terms of the MIT License.
 
 import os
+import json
+import logging
+import time
+import hashlib
+import pickle
 import numpy as np
 import pandas as pd
+try:
+    import scipy.sparse as sparse
+except ImportError:
+    sparse = None
 from tempfile import TemporaryDirectory
 from textwrap import dedent
 from sos.utils import short_repr, env
-from collections import Sequence
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from collections.abc import Sequence
 from IPython.core.error import UsageError
 import re
 import sys
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
+from itertools import islice
+from uuid import uuid4
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
 
 def homogeneous_type(seq):
-    iseq = iter(seq)
-    first_type = type(next(iseq))
+    #collecting the distinct types first keeps the per-element work in C
+    types = set(map(type, seq))
+    first_type = type(next(iter(seq)))
     if first_type in (int, float):
-        return True if all(isinstance(x, (int, float)) for x in iseq) else False
+        return all(issubclass(t, (int, float)) for t in types)
     else:
-        return True if all(isinstance(x, first_type) for x in iseq) else False
+        return all(issubclass(t, first_type) for t in types)
 
 #Include helper functions header and set std::cout rounding to a maximum length for double and float accuracy (https://stackoverflow.com/a/554780/6357726)
-cpp_init_statements = f'#include "{os.path.split(__file__)[0]}/utils.hpp"\nstd::cout.precision(std::numeric_limits<double>::digits10 + 1);'
+_cpp_header_dir = os.path.split(__file__)[0]
+cpp_init_statements = f'#include "{_cpp_header_dir}/utils.hpp"\nstd::cout.precision(std::numeric_limits<double>::digits10 + 1);'
+
+# helper headers with heavy dependencies, included the first time a generated cell uses one of the identifiers
+_lazy_headers = (('xtensor_utils.hpp', ('xt::', 'dump_npy_buffer', 'sos_set_column', 'sos_shm_adapt', 'sos_shm_export')),
+    ('xframe_utils.hpp', ('xf::', 'sos_print_labels')))
+
+# numpy dtypes matching the C++ element types that can be transferred as binary .npy files
+_cpp_numpy_dtypes = {'bool': np.bool_, 'int': np.int32, 'long int': np.int64, 'float': np.float32, 'double': np.float64}
+
+_string_put_type = '"std::__cxx11::basic_string<char, std::char_traits<char>, std::allocator<char> >"'
+
+# C++ types that %put transfers as scalars
+_scalar_put_types = ('"int"', '"short"', '"long"', '"long long"', '"float"', '"double"', '"long double"', '"char"', '"bool"', '"std::_Bit_reference"', _string_put_type)
+
+# C++ types that %put transfers as numpy arrays
+_array_put_types = ('"std::vector', '"xt::xarray_container', '"xt::xarray_adaptor', '"xt::xfunction')
+
+# numeric C++ types ordered by promotion, used to pick the common element type of DataFrame columns
+_cpp_type_rank = ['bool', 'int', 'long int', 'float', 'double', 'long double', 'std::string']
+
+# C++ containers with contiguous data() that %put can read in chunks
+_chunked_put_types = ('"std::vector', '"xt::xarray_container', '"xt::xarray_adaptor')
+
+# C++ element types that %put reads back from binary dumps, with their numpy dtypes
+_binary_put_types = {'"bool"': np.bool_, '"short"': np.int16, '"int"': np.int32, '"long"': np.int64, '"long long"': np.int64,
+    '"unsigned short"': np.uint16, '"unsigned int"': np.uint32, '"unsigned long"': np.uint64, '"unsigned long long"': np.uint64, '"float"': np.float32, '"double"': np.float64}
+
+# maps whose keys and values %put transfers as two columns
+_map_put_types = ('"std::map', '"std::unordered_map')
+_column_put_types = (*_binary_put_types, _string_put_type)
+
+# explicit instantiations of the %put helpers that take the container type as their only template parameter
+_instantiable_helpers = {
+    'sos_print_elements': 'void sos_print_elements<{0}>(const {0}&)',
+    'sos_print_labels': 'void sos_print_labels<{0}>(const {0}&, const int&)',
+    'sos_dump_chunk': 'void sos_dump_chunk<{0}>(const {0}&, std::size_t, std::size_t, const std::string&)',
+    'sos_dump_map': 'void sos_dump_map<{0}>(const {0}&, const std::string&, const std::string&, const std::string&, const std::string&)',
+}
 
 def stitch_cell_output(response):
-    return ''.join([stream[1]['text'] for stream in response ])
+    #warnings cling prints to stderr are not part of the output
+    return ''.join([stream[1]['text'] for stream in response if stream[1].get('name', 'stdout') == 'stdout'])
+
+# numpy dtypes for elements decoded from printed text, matching what np.array made of the converted values
+_text_put_dtypes = {'"int"': np.int64, '"short"': np.int64, '"long"': np.int64, '"long long"': np.int64, '"float"': np.float64, '"double"': np.float64,
+    '"long double"': np.longdouble, '"bool"': np.bool_, '"std::_Bit_reference"': np.bool_}
+
+def _unescape_record(record):
+    if '\\' not in record:
+        return record
+    return re.sub(r'\\(.)', lambda m: '\x1e' if m.group(1) == 'e' else m.group(1), record, flags=re.S)
+
+class _RecordDecoder:
+    ''' Incrementally decodes records printed by sos_print_record into a preallocated numpy array '''
+
+    def __init__(self, size, el_type=None):
+        self.values = np.empty(size, dtype=_text_put_dtypes.get(el_type, object))
+        self.count = 0
+        self._el_type = el_type
+        self._pending = ''
+
+    def feed(self, text):
+        #only the unterminated tail is carried over to the next stream message
+        records = (self._pending + text).split('\x1e')
+        self._pending = records.pop()
+        for record in records:
+            record = _unescape_record(record)
+            self.values[self.count] = record if self._el_type is None else _cpp_scalar_to_sos(self._el_type, record)
+            self.count += 1
+
+    def close(self):
+        if self._pending or self.count != self.values.size:
+            raise ValueError(f'Expected {self.values.size} values from C++, received {self.count}')
+        return self.values
 
 def _sos_to_cpp_type(obj):
     ''' Returns corresponding C++ data type string for provided Python object '''
@@ -55,6 +147,145 @@ def _sos_to_cpp_type(obj):
     else:
         return -1, None
 
+def _sos_to_cpp_dtype(arr, block=1 << 20):
+    ''' Returns C++ element type for a numpy array, picked once from the dtype and the value range of the whole array '''
+    if arr.size == 0:
+        return -1
+    if arr.dtype.kind == 'b':
+        return 'bool'
+    elif arr.dtype.kind in 'iu':
+        arr_min, arr_max = arr.min(), arr.max()
+        if arr_min >= -2147483648 and arr_max <= 2147483647:
+            return 'int'
+        elif arr_min >= -9223372036854775808 and arr_max <= 9223372036854775807:
+            return 'long int'
+    elif arr.dtype.kind == 'f':
+        if arr.dtype.itemsize > 8:
+            return 'long double'
+        #zeros, infinities and NaNs fit any floating point type, the remaining magnitudes decide between float and double;
+        #they are scanned in blocks of elements, so no copy of the whole array is made
+        low, high = np.inf, 0.0
+        for start in range(0, arr.size, block):
+            magnitude = np.abs(arr.flat[start:start + block])
+            magnitude = magnitude[np.isfinite(magnitude) & (magnitude != 0)]
+            if magnitude.size:
+                low, high = min(low, magnitude.min()), max(high, magnitude.max())
+        if high == 0 or (low >= 1.17549e-38 and high <= 3.40282e+38):
+            return 'float'
+        elif low >= 2.22507e-308 and high <= 1.79769e+308:
+            return 'double'
+    return -1
+
+def _cpp_array_values(arr, cpp_type):
+    ''' Returns comma separated C++ literals for all elements of a numeric numpy array, formatted in bulk '''
+    flat = arr.ravel()
+    if cpp_type == 'bool':
+        values = np.where(flat, 'true', 'false').tolist()
+    elif cpp_type == 'long double':
+        values = np.char.add(flat.astype(str), 'L').tolist()
+    else:
+        #tolist() converts to Python scalars in one pass, whose repr is the shortest round-trip literal
+        values = list(map(repr, flat.tolist()))
+    if flat.dtype.kind == 'f' and not np.isfinite(flat).all():
+        cpp_double = 'double' if cpp_type == 'float' else cpp_type
+        for i in np.flatnonzero(~np.isfinite(flat)).tolist():
+            if np.isnan(flat[i]):
+                values[i] = f'std::numeric_limits<{cpp_double}>::quiet_NaN()'
+            else:
+                values[i] = ('-' if flat[i] < 0 else '') + f'std::numeric_limits<{cpp_double}>::infinity()'
+    return ', '.join(values)
+
+# escapes of string literals, control characters as octal so that no following character extends them
+_cpp_string_escapes = {ord('\\'): '\\\\', ord('"'): '\\"', 127: '\\177', **{c: f'\\{c:03o}' for c in range(32)}}
+
+def _cpp_string_literal(value):
+    ''' Returns a C++ string literal for a Python string '''
+    return '"' + value.translate(_cpp_string_escapes) + '"'
+
+def _cpp_element_type(values):
+    ''' Returns C++ element type for the values of a container, using the numpy dtype when there are none '''
+    return _sos_to_cpp_dtype(values if values.size else np.zeros(1, values.dtype))
+
+def _read_column(cpp_type, path, offsets_path):
+    ''' Returns the values of a map column written by sos_dump_column as a list of Python objects '''
+    if cpp_type == _string_put_type:
+        with open(path, 'rb') as column:
+            data = column.read()
+        offsets = np.fromfile(offsets_path, dtype=np.uint64).tolist()
+        return [data[start:stop].decode(errors='replace') for start, stop in zip(offsets[:-1], offsets[1:])]
+    return np.fromfile(path, dtype=_binary_put_types[cpp_type]).tolist()
+
+def _csr_from_nested(obj):
+    ''' Returns offsets and concatenated values of a sequence of numeric sequences, or None if obj is not one '''
+    if not all(isinstance(row, (Sequence, np.ndarray)) and not isinstance(row, str) for row in obj):
+        return None
+    try:
+        rows = [np.asarray(row) for row in obj]
+    except ValueError:
+        return None
+    if any(row.ndim != 1 for row in rows):
+        return None
+    #empty rows default to float64 in numpy and must not decide the element type
+    filled = [row for row in rows if row.size]
+    dtype = np.result_type(*filled) if filled else np.dtype(np.int32)
+    if dtype.kind not in 'biuf':
+        return None
+    offsets = np.zeros(len(rows) + 1, dtype=np.uint64)
+    np.cumsum([row.size for row in rows], out=offsets[1:])
+    return offsets, np.concatenate(rows).astype(dtype, copy=False) if rows else np.empty(0, dtype)
+
+# inner element type of the std::vector<T> elements of nested vectors, as demangled by type()
+_nested_vector_type = re.compile(r'^"std::vector<([\w ]+), std::allocator<\1 ?> ?>"$')
+
+def _nested_element_type(entry):
+    ''' Returns the quoted inner element type of a nested std::vector manifest entry, or None '''
+    match = _nested_vector_type.match(entry['element_type'] or '')
+    return f'"{match.group(1)}"' if match else None
+
+def _estimated_pickle_size(obj, sample_size=100):
+    ''' Returns the size of the pickle of a list, tuple or dict estimated from its first elements, or 0 for other objects '''
+    if isinstance(obj, dict):
+        sample = list(islice(obj.items(), sample_size))
+    elif isinstance(obj, (list, tuple)):
+        sample = list(obj[:sample_size])
+    else:
+        return 0
+    if not sample:
+        return 0
+    try:
+        return len(obj) * len(pickle.dumps(sample, protocol=4)) // len(sample)
+    except Exception:
+        return 0
+
+def _content_hash(obj, max_bytes):
+    ''' Returns a digest of the value of a SoS variable and its size in bytes, or None if it is larger than max_bytes '''
+    digest = hashlib.blake2b(type(obj).__name__.encode(), digest_size=16)
+    if isinstance(obj, np.ndarray) and not obj.dtype.hasobject:
+        if obj.nbytes > max_bytes:
+            return None
+        digest.update(f'{obj.dtype.str}{obj.shape}'.encode())
+        digest.update(np.ascontiguousarray(obj).data)
+        nbytes = obj.nbytes
+    elif isinstance(obj, pd.core.frame.DataFrame):
+        nbytes = int(obj.memory_usage(index=True).sum())
+        if nbytes > max_bytes:
+            return None
+        digest.update(repr((obj.columns.tolist(), obj.dtypes.tolist())).encode())
+        digest.update(pd.util.hash_pandas_object(obj, index=True).values.data)
+    else:
+        #large containers are not pickled just to find out that they are too large
+        if _estimated_pickle_size(obj) > max_bytes:
+            return None
+        try:
+            data = pickle.dumps(obj, protocol=4)
+        except Exception:
+            return None
+        nbytes = len(data)
+        if nbytes > max_bytes:
+            return None
+        digest.update(data)
+    return digest.hexdigest(), nbytes
+
 def _cpp_scalar_to_sos(cpp_type, value):
     #Convert string value to appropriate type in SoS
     integer_types = ['"int"', '"short"', '"long"', '"long long"']
@@ -81,24 +312,598 @@ def _cpp_scalar_to_sos(cpp_type, value):
         else:
             return False
 
+class CppRequestError(RuntimeError):
+    ''' Raised when the C++ kernel does not answer a request in time or the request is cancelled '''
+
+class CppExecutionError(CppRequestError):
+    ''' Raised when the C++ kernel reports an error for a request, such as a compile error, which retrying cannot fix '''
+
+class _TransferRecord:
+    ''' Bytes, kernel round trips, retries and time per phase of the transfer of one variable '''
+
+    def __init__(self, direction, name, batch_names=None):
+        self.direction = direction
+        self.name = name
+        self.bytes = 0
+        self.round_trips = 0
+        self.retries = 0
+        self.phases = OrderedDict()
+        #number of variables moved together with this one
+        self.batch = 1
+        #variables sharing the cost of this record, and the records of transfers nested in it
+        self.batch_names = [name] if batch_names is None else batch_names
+        self.children = []
+
+    def add_time(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def absorb(self, other):
+        self.bytes += other.bytes
+        self.round_trips += other.round_trips
+        self.retries += other.retries
+        for phase, seconds in other.phases.items():
+            self.add_time(phase, seconds)
+        self.children.extend(other.children)
+
+    def split(self):
+        ''' Returns one record per variable, holding its nested records and an equal share of the bytes and time of this one '''
+        count = len(self.batch_names)
+        records = []
+        for index, name in enumerate(self.batch_names):
+            record = _TransferRecord(self.direction, name)
+            own = [child for child in self.children if child.name == name]
+            for child in own:
+                record.absorb(child)
+            record.batch = max((child.batch for child in own), default=count)
+            record.bytes += self.bytes // count + (index < self.bytes % count)
+            #round trips and retries of shared cells count for every variable
+            record.round_trips += self.round_trips
+            record.retries += self.retries
+            for phase, seconds in self.phases.items():
+                record.add_time(phase, seconds / count)
+            records.append(record)
+        return records + [child for child in self.children if child.name not in self.batch_names]
+
+    def as_dict(self):
+        return {'direction': self.direction, 'name': self.name, 'bytes': self.bytes, 'round_trips': self.round_trips,
+            'retries': self.retries, 'batch': self.batch, 'phases': dict(self.phases), 'total': sum(self.phases.values())}
+
+class TransferStats:
+    ''' Collects _TransferRecord of %get and %put while sos_xeus_cling.collect_stats is enabled '''
+
+    phases = ('hash', 'serialize', 'execute', 'round_trip', 'poll', 'decode')
+
+    #only the most recent records are kept, so that collecting statistics in a long session does not exhaust memory
+    max_records = 10000
+
+    def __init__(self):
+        self.records = deque(maxlen=self.max_records)
+
+    def add(self, record):
+        self.records.append(record)
+
+    def clear(self):
+        self.records.clear()
+
+    def summary(self):
+        ''' Returns a table of all recorded transfers, with times in milliseconds '''
+        header = f'{"dir":<4} {"name":<20} {"bytes":>12} {"trips":>6} {"retry":>6} {"batch":>6} ' + ' '.join(f'{phase:>10}' for phase in self.phases) + f' {"total":>10}'
+        lines = [header]
+        for record in self.records:
+            stats = record.as_dict()
+            lines.append(f'{record.direction:<4} {record.name[:20]:<20} {record.bytes:>12} {record.round_trips:>6} {record.retries:>6} {record.batch:>6} '
+                + ' '.join(f'{1000 * record.phases.get(phase, 0):>10.2f}' for phase in self.phases) + f' {1000 * stats["total"]:>10.2f}')
+        return '\n'.join(lines)
+
+#statistics of all instrumented transfers, print(transfer_stats.summary()) in a SoS cell to inspect them
+transfer_stats = TransferStats()
+#every finished transfer record is also logged as one JSON object for monitoring
+transfer_logger = logging.getLogger('sos_xeus_cling.transfer')
+
+class _KernelState:
+    ''' State of a C++ subkernel, which outlives the sos_xeus_cling objects sos-notebook creates for every magic '''
+
+    def __init__(self):
+        #(helper, C++ type) signatures explicitly instantiated in the subkernel
+        self.instantiated = set()
+        #content hash and size of variables sent by %get, least recently used first
+        self.get_cache = OrderedDict()
+
+#states by SoS kernel and subkernel name, replaced when the subkernel (re)starts and dropped with the SoS kernel
+_kernel_states = weakref.WeakKeyDictionary()
+
+#calls into the SoS kernel run one at a time on daemon threads, so a call that never returns can be abandoned
+_kernel_call_lock = threading.Lock()
+
+class CppArrayProxy:
+    ''' Stand-in for a large C++ array put to SoS, fetching only the regions that are indexed, each of them once '''
+
+    def __init__(self, module, name, shape, dtype, cache_bytes):
+        self._module = module
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self._cache_bytes = cache_bytes
+        #fetched blocks by their (start, stop) bounds per dimension, least recently used first
+        self._blocks = OrderedDict()
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return f'CppArrayProxy({self.name}, shape={self.shape}, dtype={self.dtype})'
+
+    def __array__(self, dtype=None, copy=None):
+        values = self._block(tuple((0, n) for n in self.shape))
+        return values.astype(dtype or values.dtype) if copy or dtype is not None else values
+
+    def __getitem__(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        if sum(k is Ellipsis for k in key) == 1:
+            i = next(i for i, k in enumerate(key) if k is Ellipsis)
+            key = key[:i] + (slice(None),) * (self.ndim - len(key) + 1) + key[i + 1:]
+        if len(key) > self.ndim or not all(isinstance(k, (slice, int, np.integer)) for k in key):
+            #advanced indexing needs the whole array
+            return np.asarray(self)[key]
+        key = key + (slice(None),) * (self.ndim - len(key))
+        bounds, local = [], []
+        for k, n in zip(key, self.shape):
+            if isinstance(k, slice):
+                start, stop, step = k.indices(n)
+                if not len(range(start, stop, step)):
+                    #nothing to fetch, the shape of the result follows from indexing a zero-strided array
+                    return np.lib.stride_tricks.as_strided(np.zeros(1, self.dtype), shape=self.shape, strides=(0,) * self.ndim)[key].copy()
+                low, high = (start, stop) if step > 0 else (stop + 1, start + 1)
+                bounds.append((low, high))
+                local.append(slice(start - low, stop - low if stop >= low else None, step))
+            else:
+                index = int(k) + n if k < 0 else int(k)
+                if not 0 <= index < n:
+                    raise IndexError(f'index {k} is out of bounds for axis with size {n}')
+                bounds.append((index, index + 1))
+                local.append(0)
+        return self._block(tuple(bounds))[tuple(local)]
+
+    def _block(self, bounds):
+        #cut the block out of a cached one containing it if possible
+        for cached, values in self._blocks.items():
+            if all(low <= start and stop <= high for (start, stop), (low, high) in zip(bounds, cached)):
+                self._blocks.move_to_end(cached)
+                return values[tuple(slice(start - low, stop - low) for (start, stop), (low, high) in zip(bounds, cached))]
+        values = self._module._fetch_block(self.name, bounds)
+        #regions are views of cached blocks, so they must not be modified in place
+        values.flags.writeable = False
+        if values.nbytes <= self._cache_bytes:
+            self._blocks[bounds] = values
+            while sum(block.nbytes for block in self._blocks.values()) > self._cache_bytes:
+                self._blocks.popitem(last=False)
+        return values
+
+class _SharedMemoryBase:
+    ''' Base of a numpy array returned by %put that keeps its shared memory segment mapped '''
+
+    def __init__(self, segment, shape, dtype):
+        #arrays only reference this object as their base, and the segment is unmapped by its own finalizer
+        #once the last array using it is gone
+        self._segment = segment
+        self.__array_interface__ = np.ndarray(shape, dtype=dtype, buffer=segment.buf).__array_interface__
+
+class _StagedTransfer(threading.local):
+    ''' Temporary files and shared memory segments of the transfer prepared by the current thread '''
+
+    def __init__(self):
+        self.files = []
+        self.segments = []
+
 class sos_xeus_cling:
     background_color = {'C++11': '#B3BFFF', 'C++14': '#D5CCFF', 'C++17': '#EAE6FF'}
     supported_kernels = {'C++11': ['xeus-cling-cpp11'], 'C++14' : ['xeus-cling-cpp14'], 'C++17' : ['xeus-cling-cpp17']}
     options = {}
     cd_command = '#include <unistd.h>\nchdir("{dir}");'
+    #numpy arrays with at least this many elements are passed to C++ through a temporary .npy file instead of an initializer list
+    binary_get_threshold = 10000
+    #std::vector and xtensor arrays of numeric types are returned from C++ as binary .npy dumps instead of printed text
+    binary_put = True
+    #%get skips variables whose content hash matches the value C++ still holds; up to get_cache_size values of
+    #get_cache_max_bytes in total are remembered, and larger values are not hashed
+    get_cache_size = 128
+    get_cache_max_bytes = 1 << 28
+    #numeric arrays larger than chunk_size bytes are moved in blocks of chunk_size bytes into preallocated containers
+    chunk_size = 1 << 26
+    #record bytes, round trips, retries and time per phase of every transfer in transfer_stats
+    collect_stats = False
+    #requests to C++ are retried with exponential backoff from request_backoff up to request_max_backoff seconds,
+    #and fail with CppRequestError after request_retries retries or request_timeout seconds, which also limits every
+    #declaration and dump cell
+    request_timeout = 60.0
+    request_retries = 10
+    request_backoff = 0.01
+    request_max_backoff = 2.0
+    #numeric arrays are handed over through POSIX shared memory segments, which C++ maps as xtensor adaptors
+    #and SoS as numpy arrays, instead of .npy files; both kernels have to run on the same host
+    shared_memory = False
+    #number of threads serializing the next variables of a %get while C++ declares the current one, 0 to disable
+    get_workers = 0
+    #%put of xtensor arrays larger than lazy_put_threshold bytes into SoS creates a CppArrayProxy that fetches
+    #regions on indexing and keeps up to proxy_cache_bytes of fetched blocks; None always transfers arrays in full
+    lazy_put_threshold = None
+    proxy_cache_bytes = 1 << 28
+    #include the xtensor and xframe helpers at subkernel start instead of on first use, e.g. when the
+    #kernel loads them from a precompiled header or module cache anyway
+    preload_headers = False
+    #declare dicts as std::unordered_map instead of std::map
+    unordered_maps = False
 
     def __init__(self, sos_kernel, kernel_name='C++11'):
         self.sos_kernel = sos_kernel
         self.kernel_name = kernel_name
-        self.init_statements = cpp_init_statements
+        self._transfer_dir = None
+        self._staged = _StagedTransfer()
+        self._transfer_dir_lock = threading.Lock()
+        self._record = None
+        self._cancelled = threading.Event()
 
-    def insistent_get_response(self, command, stream):
-        response = self.sos_kernel.get_response(command, stream)
-        while response==[]:
-            response = self.sos_kernel.get_response(command, stream)
+    @property
+    def init_statements(self):
+        #read when the subkernel (re)starts, which forgets all transferred variables and instantiated helpers
+        _kernel_states.setdefault(self.sos_kernel, {})[self.kernel_name] = _KernelState()
+        if not self.preload_headers:
+            return cpp_init_statements
+        return cpp_init_statements + ''.join(f'\n#include "{_cpp_header_dir}/{header}"' for header, identifiers in _lazy_headers)
 
-        return response
+    @property
+    def _state(self):
+        return _kernel_states.setdefault(self.sos_kernel, {}).setdefault(self.kernel_name, _KernelState())
+
+    def _include_headers(self, code):
+        ''' Prepends includes of the helper headers that code needs '''
+        #every cell includes what it uses, which #pragma once makes free once a header is loaded, so a cell that
+        #cling rejects or a restart that skipped init_statements cannot leave later cells without their helpers
+        return ''.join(f'#include "{_cpp_header_dir}/{header}"\n' for header, identifiers in _lazy_headers if any(identifier in code for identifier in identifiers)) + code
+
+    @contextmanager
+    def _transfer(self, direction, names):
+        ''' Records the transfer of one variable, or of a list of variables whose shared cost is split over them '''
+        if not self.collect_stats:
+            yield
+            return
+        outer = self._record
+        if isinstance(names, str):
+            self._record = _TransferRecord(direction, names)
+        else:
+            self._record = _TransferRecord(direction, ', '.join(names), list(names))
+        record = self._record
+        try:
+            yield
+        finally:
+            self._record = outer
+            if outer is not None and not record.batch_names:
+                #the cost of a batch that moved none of its variables is shared by all variables of the enclosing transfer
+                outer.absorb(record)
+            elif outer is not None:
+                outer.children.extend(record.split())
+            else:
+                for split in (record.split() if record.batch_names else [record]):
+                    transfer_stats.add(split)
+                    transfer_logger.info(json.dumps(split.as_dict()))
 
+    @contextmanager
+    def _phase(self, phase):
+        if self._record is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record.add_time(phase, time.perf_counter() - start)
+
+    def _run_cell(self, code, on_error):
+        self._cancelled.clear()
+        code = self._include_headers(code)
+        with self._phase('execute'):
+            if self._record is not None:
+                self._record.bytes += len(code)
+                self._record.round_trips += 1
+            return self._call_kernel(code, time.monotonic() + self.request_timeout, self.sos_kernel.run_cell, code, True, False, on_error=on_error)
+
+    def _instantiate(self, helper, *entries):
+        ''' Explicitly instantiates helper for the C++ types of manifest entries, once per subkernel session '''
+        #types of lambdas, expressions and other unnamed entities cannot be spelled in C++
+        cpp_types = {entry['type'].strip('"') for entry in entries if not entry['type'].startswith('"xt::xfunction')}
+        cpp_types = sorted(cpp_type for cpp_type in cpp_types if (helper, cpp_type) not in self._state.instantiated and not any(x in cpp_type for x in ('lambda', 'anonymous', '{')))
+        if not cpp_types:
+            return
+        self._state.instantiated.update((helper, cpp_type) for cpp_type in cpp_types)
+        #the helper is compiled here once, so later transfers of the same type only JIT their call
+        self._run_cell(' '.join(f'template {_instantiable_helpers[helper].format(cpp_type)};' for cpp_type in cpp_types), on_error=f'Failed to instantiate {helper} for {", ".join(cpp_types)}')
+
+    def _transfer_file(self, suffix='.npy'):
+        ''' Returns a new file name in the temporary directory shared with the C++ kernel '''
+        with self._transfer_dir_lock:
+            if self._transfer_dir is None:
+                self._transfer_dir = TemporaryDirectory(prefix='sos_xeus_cling_')
+        path = os.path.join(self._transfer_dir.name, uuid4().hex + suffix)
+        self._staged.files.append(path)
+        return path
+
+    def _cleanup_transfer_files(self, record=True):
+        #files and segments that were not sent, or are removed by a pipeline worker, are not counted in the current transfer
+        record = self._record if record else None
+        for path in self._staged.files:
+            if os.path.exists(path):
+                if record is not None:
+                    record.bytes += os.path.getsize(path)
+                os.remove(path)
+        self._staged.files = []
+        for segment in self._staged.segments:
+            if record is not None:
+                record.bytes += segment.size
+            segment.close()
+            segment.unlink()
+        self._staged.segments = []
+
+    def _use_shared_memory(self):
+        return self.shared_memory and shared_memory is not None and os.name == 'posix'
+
+    def _Cpp_binary_declare_string(self, name, obj, cpp_type):
+        if self._use_shared_memory() and obj.size:
+            return self._Cpp_shm_declare_string(name, obj, cpp_type)
+        #write array to .npy file and let xtensor load it with the same element type the initializer list would produce
+        path = self._transfer_file()
+        np.save(path, np.ascontiguousarray(obj, dtype=_cpp_numpy_dtypes[cpp_type]))
+        return f'xt::xarray<{cpp_type}> {name} = xt::load_npy<{cpp_type}>("{path}");'
+
+    def _Cpp_shm_declare_string(self, name, obj, cpp_type):
+        #copy array into a shared memory segment that C++ maps as an xtensor adaptor; the segment is unlinked
+        #after the declaration, and the mapping lives as long as the C++ variable
+        dtype = np.dtype(_cpp_numpy_dtypes[cpp_type])
+        segment = shared_memory.SharedMemory(create=True, size=obj.size * dtype.itemsize)
+        self._staged.segments.append(segment)
+        buffer = np.ndarray(obj.shape, dtype=dtype, buffer=segment.buf)
+        buffer[...] = obj
+        del buffer
+        shape = ', '.join(str(x) for x in obj.shape)
+        return f'auto {name} = sos_shm_adapt<{cpp_type}>("/{segment.name}", {{ {shape} }});'
+
+    def _Cpp_vector_expression(self, values, cpp_type, dtype):
+        ''' Returns a C++ std::vector expression holding values, read from a raw buffer written as dtype when they are many '''
+        if values.size >= self.binary_get_threshold and dtype is not None:
+            path = self._transfer_file('.bin')
+            values.astype(dtype, copy=False).tofile(path)
+            return f'sos_read_buffer<{cpp_type}>("{path}")'
+        return f'std::vector<{cpp_type}>{{ {_cpp_array_values(values, cpp_type)} }}'
+
+    def _Cpp_nested_declare_string(self, name, offsets, values):
+        #ragged sequences are sent as CSR offsets and concatenated values, and rebuilt as std::vector<std::vector<T>> in C++
+        cpp_type = _cpp_element_type(values)
+        if cpp_type == -1:
+            return None
+        offsets = self._Cpp_vector_expression(offsets, 'std::size_t', np.uint64)
+        values = self._Cpp_vector_expression(values, cpp_type, _cpp_numpy_dtypes.get(cpp_type))
+        return f'std::vector<std::vector<{cpp_type}>> {name} = sos_from_csr<{cpp_type}>({offsets}, {values});'
+
+    def _Cpp_strings_expression(self, strings):
+        ''' Returns a C++ std::vector<std::string> expression, read from their concatenated bytes and offsets when they are many '''
+        if len(strings) >= self.binary_get_threshold:
+            text = ''.join(strings)
+            data = text.encode()
+            path = self._transfer_file('.bin')
+            with open(path, 'wb') as column:
+                column.write(data)
+            #characters are single bytes unless the text has non-ASCII ones
+            lengths = map(len, strings) if len(data) == len(text) else (len(x.encode()) for x in strings)
+            offsets = np.zeros(len(strings) + 1, dtype=np.uint64)
+            np.cumsum(np.fromiter(lengths, dtype=np.uint64, count=len(strings)), out=offsets[1:])
+            return f'sos_read_strings(sos_read_buffer<char>("{path}"), {self._Cpp_vector_expression(offsets, "std::size_t", np.uint64)})'
+        return f'std::vector<std::string>{{ {", ".join(map(_cpp_string_literal, strings))} }}'
+
+    def _Cpp_map_declare_string(self, name, obj):
+        #keys and values are sent as two typed columns and zipped into the map by one bulk insert in C++
+        columns = []
+        for values in (list(obj.keys()), list(obj.values())):
+            if isinstance(values[0], str):
+                columns.append(('std::string', self._Cpp_strings_expression(values)))
+                continue
+            values = np.asarray(values)
+            cpp_type = _sos_to_cpp_dtype(values) if values.ndim == 1 and values.dtype.kind in 'biuf' else -1
+            if cpp_type == -1:
+                return None
+            #distinct double keys must not collapse into one float key
+            if cpp_type == 'float' and not columns:
+                cpp_type = 'double'
+            columns.append((cpp_type, self._Cpp_vector_expression(values, cpp_type, _cpp_numpy_dtypes.get(cpp_type))))
+        (key_type, keys), (value_type, values) = columns
+        map_type = 'unordered_map' if self.unordered_maps else 'map'
+        return f'std::{map_type}<{key_type}, {value_type}> {name} = sos_zip_{map_type}({keys}, {values});'
+
+    def _Cpp_sparse_declare_string(self, name, obj):
+        #sparse matrices keep their compressed form in C++, so the transfer scales with the number of stored elements
+        if obj.format not in ('csr', 'csc', 'coo'):
+            obj = obj.tocsr()
+        #double values are kept as double, since there is no older literal path whose float precision to match
+        cpp_type = 'double' if obj.dtype == np.float64 else _cpp_element_type(obj.data)
+        if cpp_type == -1:
+            return None
+        indices = (obj.row, obj.col) if obj.format == 'coo' else (obj.indices, obj.indptr)
+        arrays = [self._Cpp_vector_expression(obj.data, cpp_type, _cpp_numpy_dtypes.get(cpp_type))] + [self._Cpp_vector_expression(x, 'std::size_t', np.uint64) for x in indices]
+        return f'sos_{obj.format}_matrix<{cpp_type}> {name}{{ {obj.shape[0]}, {obj.shape[1]}, {", ".join(arrays)} }};'
+
+    def _Cpp_dataframe_declare_string(self, name, obj):
+        #transfer every column as its own typed buffer and assemble the xframe data from the columns in C++
+        col_types = []
+        for col in range(obj.shape[1]):
+            values = obj.iloc[:, col].to_numpy()
+            if values.dtype.kind in 'biuf':
+                col_types.append(_sos_to_cpp_dtype(values))
+            elif all(isinstance(x, str) for x in values):
+                col_types.append('std::string')
+            else:
+                col_types.append(-1)
+        if -1 in col_types or (('std::string' in col_types) and len(set(col_types)) > 1):
+            return None
+        df_type = max(col_types, key=_cpp_type_rank.index)
+        #float holds integers exactly only up to 2^24
+        if df_type == 'float' and ('int' in col_types or 'long int' in col_types):
+            df_type = 'double'
+
+        df_columns = []
+        for col, col_type in enumerate(col_types):
+            values = obj.iloc[:, col].to_numpy()
+            if obj.shape[0] >= self.binary_get_threshold and col_type in _cpp_numpy_dtypes:
+                path = self._transfer_file()
+                np.save(path, np.ascontiguousarray(values, dtype=_cpp_numpy_dtypes[col_type]))
+                df_columns.append(f'sos_set_column({name}_data, {col}, xt::load_npy<{col_type}>("{path}"));')
+            elif col_type == 'std::string':
+                df_columns.append(f'sos_set_column({name}_data, {col}, xt::xarray<std::string>({{ {", ".join(_sos_to_cpp_type(x)[1] for x in values)} }}));')
+            else:
+                df_columns.append(f'sos_set_column({name}_data, {col}, xt::xarray<{col_type}>({{ {_cpp_array_values(values, col_type)} }}));')
+
+        df_cols = '{ ' + ','.join([_sos_to_cpp_type(j)[1] for j in obj.columns.tolist()]) + ' }'
+        index = obj.index.to_numpy()
+        #many row labels are read as a std::vector like the columns, instead of being parsed from a literal
+        if obj.shape[0] >= self.binary_get_threshold and index.dtype.kind in 'iu' and _sos_to_cpp_dtype(index) in _cpp_numpy_dtypes:
+            index_type = _sos_to_cpp_dtype(index)
+            x_axis = f'sos_axis({self._Cpp_vector_expression(index, index_type, _cpp_numpy_dtypes[index_type])})'
+        elif obj.shape[0] >= self.binary_get_threshold and all(isinstance(i, str) for i in index):
+            x_axis = f'sos_axis({self._Cpp_strings_expression(index.tolist())})'
+        elif obj.index.dtype.kind in 'iu':
+            x_axis = 'xf::axis({ ' + _cpp_array_values(index, _sos_to_cpp_dtype(index)) + ' })'
+        else:
+            x_axis = 'xf::axis({ ' + ','.join([_sos_to_cpp_type(i)[1] for i in obj.index.values]) + ' })'
+        return f'xt::xarray<{df_type}> {name}_data = xt::empty<{df_type}>({{ {obj.shape[0]}, {obj.shape[1]} }}); ' + ' '.join(df_columns) + f' auto {name}_x_axis = {x_axis}; auto {name}_y_axis = xf::axis({df_cols}); auto {name}_coord = xf::coordinate({{{{"x", {name}_x_axis}}, {{"y", {name}_y_axis}}}}); auto {name}_dim = xf::dimension({{"x", "y"}}); auto {name} = xf::variable({name}_data,{name}_coord,{name}_dim);'
+
+    def _report_progress(self, name, done, total):
+        env.logger.info(f'Transferring {name}: {done}/{total} elements ({100 * done // total}%)')
+
+    def _chunk_elements(self, dtype):
+        return max(1, self.chunk_size // np.dtype(dtype).itemsize)
+
+    def _get_chunked(self, name, obj, cpp_type):
+        #preallocate the xarray and fill it block by block, so neither side holds more than one extra chunk
+        dtype = _cpp_numpy_dtypes[cpp_type]
+        step = self._chunk_elements(dtype)
+        shape = '{ ' + ', '.join(str(i) for i in obj.shape) + ' }'
+        self._run_cell(f'xt::xarray<{cpp_type}> {name} = xt::empty<{cpp_type}>({shape});', on_error=f'Failed to put variable {name} to C++')
+        for start in range(0, obj.size, step):
+            path = self._transfer_file('.bin')
+            with self._phase('serialize'):
+                np.asarray(obj.flat[start:start + step], dtype=dtype).tofile(path)
+            self._run_cell(f'sos_load_chunk({name}, {start}, "{path}");', on_error=f'Failed to put variable {name} to C++')
+            self._cleanup_transfer_files()
+            self._report_progress(name, min(start + step, obj.size), obj.size)
+
+    def _put_chunked(self, name, shape, el_type):
+        #fill a preallocated numpy array from raw blocks dumped by C++
+        dtype = _binary_put_types[el_type]
+        value = np.empty(shape, dtype=dtype)
+        flat = value.reshape(-1)
+        step = self._chunk_elements(dtype)
+        for start in range(0, flat.size, step):
+            count = min(step, flat.size - start)
+            path = self._transfer_file('.bin')
+            self._run_cell(f'sos_dump_chunk({name}, {start}, {count}, "{path}");', on_error=f'Failed to dump variable {name} from C++')
+            try:
+                if not os.path.exists(path):
+                    return None
+                with self._phase('decode'):
+                    flat[start:start + count] = np.fromfile(path, dtype=dtype)
+            finally:
+                self._cleanup_transfer_files()
+            self._report_progress(name, start + count, flat.size)
+        return value
+
+    def cancel(self):
+        ''' Aborts the pending request to C++, which then raises CppRequestError '''
+        self._cancelled.set()
+
+    def _interrupt(self):
+        ''' Interrupts the cell the C++ subkernel is running, so that it can take the next request '''
+        manager = getattr(self.sos_kernel, 'KM', None)
+        if manager is None:
+            return
+        try:
+            manager.interrupt_kernel()
+        except Exception as e:
+            self.sos_kernel.warn(f'Failed to interrupt C++: {e}')
+
+    def _call_kernel(self, command, deadline, func, *args, **kwargs):
+        ''' Returns func(*args, **kwargs) called on a worker thread, raising CppRequestError when it does not return by deadline or is cancelled '''
+        future = Future()
+
+        def call():
+            with _kernel_call_lock:
+                if not future.set_running_or_notify_cancel():
+                    return
+                try:
+                    future.set_result(func(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+
+        start = time.monotonic()
+        threading.Thread(target=call, daemon=True).start()
+        #the wait is split into short steps, so that cancel() takes effect while the kernel is busy
+        while True:
+            try:
+                return future.result(timeout=max(0, min(0.05, deadline - time.monotonic())))
+            except FutureTimeoutError:
+                pass
+            if self._cancelled.is_set() or time.monotonic() >= deadline:
+                break
+        #a call still waiting for an earlier one never reaches the kernel, a running one is stopped by the interrupt
+        if not future.cancel():
+            self._interrupt()
+        if self._cancelled.is_set():
+            raise CppRequestError(f'Request to C++ was cancelled: {short_repr(command)}')
+        raise CppRequestError(f'No response from C++ after {time.monotonic() - start:.2f} seconds: {short_repr(command)}')
+
+    def _stream_response(self, command, deadline):
+        ''' Returns the stream messages of the response to command, raising CppExecutionError if it failed '''
+        response = self._call_kernel(command, deadline, self.sos_kernel.get_response, command, ('stream', 'error'))
+        errors = [content for msg_type, content in response if msg_type == 'error']
+        if errors:
+            raise CppExecutionError(f'{errors[0].get("ename", "Error")}: {errors[0].get("evalue", "")} in {short_repr(command)}')
+        return [(msg_type, content) for msg_type, content in response if msg_type == 'stream']
+
+    def _request(self, command):
+        ''' Returns the response of the C++ kernel to command, retried with backoff while it is empty '''
+        self._cancelled.clear()
+        start = time.monotonic()
+        deadline = start + self.request_timeout
+        delay = self.request_backoff
+        retries = 0
+        command = self._include_headers(command)
+        with self._phase('round_trip'):
+            response = self._stream_response(command, deadline)
+        #get_response returns once the cell is idle, so an empty response without an error means the output was lost
+        with self._phase('poll'):
+            while response == [] and retries < self.request_retries and time.monotonic() < deadline:
+                retries += 1
+                if self._record is not None:
+                    self._record.retries += 1
+                #the wait wakes up immediately when the request is cancelled
+                if self._cancelled.wait(min(delay, max(0, deadline - time.monotonic()))):
+                    raise CppRequestError(f'Request to C++ was cancelled: {short_repr(command)}')
+                delay = min(2 * delay, self.request_max_backoff)
+                response = self._stream_response(command, deadline)
+        if response == []:
+            raise CppRequestError(f'No response from C++ after {time.monotonic() - start:.2f} seconds and {retries} retries: {short_repr(command)}')
+        if self._record is not None:
+            self._record.round_trips += 1
+            self._record.bytes += len(command) + sum(len(content.get('text', '')) for msg_type, content in response)
+        return response
 
     def _Cpp_declare_command_string(self, name, obj):
         #Check if object is scalar
@@ -115,88 +920,456 @@ class sos_xeus_cling:
                 #TODO: how to deal with an empty array?
                 return ''
             else:
-                if isinstance(obj, dict): #convert Python dict to C++'s std::map
-                    keys = obj.keys()
-                    values = obj.values()
-                    if homogeneous_type(keys) and homogeneous_type(values):
-                        dict_value = '{ ' + ', '.join([f'{{{ _sos_to_cpp_type(d[0])[1] }, { _sos_to_cpp_type(d[1])[1] }}}' for d in obj.items()])  + ' }'
-                        return f'std::map<{_sos_to_cpp_type(next(iter(keys)))[0]}, {_sos_to_cpp_type(next(iter(values)))[0]}> {name} = {dict_value};'
+                if isinstance(obj, dict): #convert Python dict to C++'s std::map or std::unordered_map
+                    if homogeneous_type(obj.keys()) and homogeneous_type(obj.values()):
+                        return self._Cpp_map_declare_string(name, obj)
                     else:
                         return None
                 elif isinstance(obj, Sequence):
+                    if isinstance(obj[0], (int, float, bool, np.number, np.bool_)):
+                        #numeric sequences take the vectorized numpy path
+                        try:
+                            seq_arr = np.asarray(obj)
+                        except ValueError:
+                            seq_arr = None
+                        if seq_arr is not None and seq_arr.ndim == 1 and seq_arr.dtype.kind in 'biuf':
+                            seq_type = _sos_to_cpp_dtype(seq_arr)
+                            if not seq_type == -1:
+                                return f'std::vector<{seq_type}> {name} = {{ {_cpp_array_values(seq_arr, seq_type)} }};'
+                    csr = _csr_from_nested(obj)
+                    if csr is not None:
+                        return self._Cpp_nested_declare_string(name, *csr)
+                    elif isinstance(obj[0], (Sequence, np.ndarray)) and not isinstance(obj[0], str):
+                        #nested sequences of other than numeric elements
+                        return None
                     if homogeneous_type(obj):
                         seq_value = '{ ' + ', '.join([_sos_to_cpp_type(s)[1] for s in obj]) + ' }'
                         return f'std::vector<{ _sos_to_cpp_type(next(iter(obj)))[0] }> {name} = {seq_value};'
                     else:
                         return None
                 elif isinstance(obj, np.ndarray):
-                    ndarr_value = '{ ' + ', '.join([_sos_to_cpp_type(s)[1] for s in obj.flatten()]) + ' }'
+                    ndarr_type = _sos_to_cpp_dtype(obj) if obj.dtype.kind in 'biuf' else _sos_to_cpp_type(obj.flat[0])[0] if obj.size else -1
+                    if ndarr_type == -1:
+                        return None
+                    if obj.size >= self.binary_get_threshold and ndarr_type in _cpp_numpy_dtypes:
+                        return self._Cpp_binary_declare_string(name, obj, ndarr_type)
+                    if obj.dtype.kind in 'biuf':
+                        ndarr_value = '{ ' + _cpp_array_values(obj, ndarr_type) + ' }'
+                    else:
+                        ndarr_value = '{ ' + ', '.join([_sos_to_cpp_type(s)[1] for s in obj.flatten()]) + ' }'
                     ndarr_shape = '{ ' + ','.join([str(i) for i in obj.shape]) + ' }'
-                    return f'xt::xarray<{ _sos_to_cpp_type(obj.flat[0])[0] }> {name} = {ndarr_value}; {name}.reshape({ndarr_shape})'
+                    return f'xt::xarray<{ndarr_type}> {name} = {ndarr_value}; {name}.reshape({ndarr_shape});'
                 elif isinstance(obj, pd.core.frame.DataFrame):
-                    df_cols = '{ ' + ','.join([_sos_to_cpp_type(j)[1] for j in obj.columns.tolist()]) + ' }'
-                    df_rows = '{ ' + ','.join([_sos_to_cpp_type(i)[1] for i in obj.index.values]) + ' }'
-                    df_type = _sos_to_cpp_type(obj.values.flatten()[0])[0]
-                    df_flat_list = '{ ' + ', '.join([_sos_to_cpp_type(s)[1] for s in obj.values.flatten()]) + ' }'
-                    df_shape = '{ ' + ','.join([str(i) for i in obj.values.shape]) + ' }'
-                    return f'xt::xarray<{df_type}> {name}_data = {df_flat_list}; {name}_data.reshape({df_shape}); auto {name}_x_axis = xf::axis({df_rows}); auto {name}_y_axis = xf::axis({df_cols}); auto {name}_coord = xf::coordinate({{{{"x", {name}_x_axis}}, {{"y", {name}_y_axis}}}}); auto {name}_dim = xf::dimension({{"x", "y"}}); auto {name} = xf::variable({name}_data,{name}_coord,{name}_dim);'
+                    return self._Cpp_dataframe_declare_string(name, obj)
+        elif sparse is not None and sparse.issparse(obj):
+            return self._Cpp_sparse_declare_string(name, obj)
         else:
             #unsupported type
             return None
 
+    def _binary_put_values(self, names):
+        #let xtensor dump the contiguous buffers of all variables in one cell and load them back bit-exact
+        if not names:
+            return {}
+        paths = {name: self._transfer_file() for name in names}
+        self._run_cell(' '.join(f'dump_npy_buffer("{path}", {name});' for name, path in paths.items()), on_error=f'Failed to dump variables {", ".join(names)} from C++')
+        try:
+            with self._phase('decode'):
+                return {name: np.load(path) for name, path in paths.items() if os.path.exists(path)}
+        finally:
+            self._cleanup_transfer_files()
+
+    def _map_put_values(self, manifest, names):
+        #let C++ write keys and values of maps as two columns, and zip them into dicts in one pass
+        if not names:
+            return {}
+        self._instantiate('sos_dump_map', *(manifest[name] for name in names))
+        paths = {name: [self._transfer_file('.bin') for column in range(4)] for name in names}
+        self._run_cell(' '.join(f'sos_dump_map({name}, {", ".join(chr(34) + path + chr(34) for path in name_paths)});' for name, name_paths in paths.items()), on_error=f'Failed to dump variables {", ".join(names)} from C++')
+        try:
+            result = {}
+            with self._phase('decode'):
+                for name, (keys_path, key_offsets_path, values_path, value_offsets_path) in paths.items():
+                    if os.path.exists(keys_path) and os.path.exists(values_path):
+                        keys = _read_column(manifest[name]['key_type'], keys_path, key_offsets_path)
+                        values = _read_column(manifest[name]['value_type'], values_path, value_offsets_path)
+                        result[name] = dict(zip(keys, values))
+            return result
+        finally:
+            self._cleanup_transfer_files()
+
+    def _csr_put_values(self, manifest, names):
+        #let C++ write offsets and concatenated values of nested vectors, and split the values into views of one buffer
+        if not names:
+            return {}
+        paths = {name: (self._transfer_file('.bin'), self._transfer_file('.bin')) for name in names}
+        self._run_cell(' '.join(f'sos_dump_csr({name}, "{offsets_path}", "{values_path}");' for name, (offsets_path, values_path) in paths.items()), on_error=f'Failed to dump variables {", ".join(names)} from C++')
+        try:
+            result = {}
+            with self._phase('decode'):
+                for name, (offsets_path, values_path) in paths.items():
+                    if os.path.exists(offsets_path) and os.path.exists(values_path):
+                        offsets = np.fromfile(offsets_path, dtype=np.uint64).astype(np.intp)
+                        values = np.fromfile(values_path, dtype=_binary_put_types[_nested_element_type(manifest[name])])
+                        result[name] = np.split(values, offsets[1:-1]) if offsets.size > 1 else []
+            return result
+        finally:
+            self._cleanup_transfer_files()
+
+    def _fetch_block(self, name, bounds):
+        ''' Returns the block of a C++ array within bounds, a (start, stop) pair per dimension '''
+        path = self._transfer_file()
+        ranges = ', '.join(f'xt::range({start}, {stop})' for start, stop in bounds)
+        #proxies are indexed from SoS cells, while run_cell sends code to the subkernel that was used last
+        previous = self.sos_kernel.kernel
+        self.sos_kernel.switch_kernel(self.kernel_name)
+        with self._transfer('put', name):
+            try:
+                self._run_cell(f'dump_npy_buffer("{path}", xt::view({name}, {ranges}));', on_error=f'Failed to fetch {name} from C++')
+                if not os.path.exists(path):
+                    raise CppRequestError(f'Failed to fetch {name}[{", ".join(f"{start}:{stop}" for start, stop in bounds)}] from C++')
+                with self._phase('decode'):
+                    return np.load(path)
+            finally:
+                self._cleanup_transfer_files()
+                self.sos_kernel.switch_kernel(previous)
+
+    def _put_sparse(self, name, cpp_type):
+        ''' Returns a scipy.sparse matrix rebuilt from the arrays of a C++ sparse matrix, or None '''
+        #sos_csr_matrix and sos_csc_matrix are aliases of sos_compressed_matrix, whose flag tells rows from columns
+        form, el_type, rows = re.match(r'^"sos_(\w+)_matrix<(.+?)(?:, (true|false))?>"$', cpp_type).groups()
+        if form == 'compressed':
+            form = 'csr' if rows == 'true' else 'csc'
+        if sparse is None or f'"{el_type}"' not in _binary_put_types:
+            self.sos_kernel.warn(f'Type {cpp_type} is not supported' + (' without scipy' if sparse is None else ''))
+            return None
+        paths = [self._transfer_file('.bin') for i in range(3)]
+        try:
+            rows, cols = self._decode_records(f'sos_dump_sparse({name}, ' + ', '.join(f'"{path}"' for path in paths) + ');', 2, '"long"').tolist()
+            with self._phase('decode'):
+                data = np.fromfile(paths[0], dtype=_binary_put_types[f'"{el_type}"'])
+                first, second = (np.fromfile(path, dtype=np.uint64).astype(np.int64) for path in paths[1:])
+                if form == 'coo':
+                    return sparse.coo_matrix((data, (first, second)), shape=(rows, cols))
+                return (sparse.csr_matrix if form == 'csr' else sparse.csc_matrix)((data, first, second), shape=(rows, cols))
+        finally:
+            self._cleanup_transfer_files()
+
+    def _shm_put_values(self, manifest, names):
+        #let C++ copy the contiguous buffers into new shared memory segments and wrap them as numpy arrays without copying
+        if not names:
+            return {}
+        segments = {name: f'sos_{uuid4().hex[:24]}' for name in names if manifest[name]['size']}
+        self._run_cell(' '.join(f'sos_shm_export("/{segment}", {name});' for name, segment in segments.items()), on_error=f'Failed to export variables {", ".join(names)} from C++')
+        result = {name: np.empty(manifest[name]['shape'], dtype=_binary_put_types[manifest[name]['element_type']]) for name in names if name not in segments}
+        for name, segment in segments.items():
+            try:
+                shm = shared_memory.SharedMemory(name=segment)
+            except FileNotFoundError:
+                continue
+            #the mapping stays valid after unlink, so no segment outlives the arrays using it
+            shm.unlink()
+            result[name] = np.asarray(_SharedMemoryBase(shm, manifest[name]['shape'], _binary_put_types[manifest[name]['element_type']]))
+            if self._record is not None:
+                self._record.bytes += shm.size
+        return result
+
+    def _decode_records(self, command, size, el_type=None):
+        ''' Returns the records printed by a C++ command as a numpy array of size elements '''
+        return self._decode_records_many([(command, size)], el_type)[0]
+
+    def _decode_records_many(self, requests, el_type=None):
+        ''' Returns records of several (command, size) requests, pipelined through a single cell '''
+        #records are counted, so the outputs of the commands need no separators
+        decoder = _RecordDecoder(sum(size for command, size in requests), el_type)
+        if any(size for command, size in requests):
+            response = self._request(' '.join(command for command, size in requests if size))
+            with self._phase('decode'):
+                for msg_type, content in response:
+                    if content.get('name', 'stdout') == 'stdout':
+                        decoder.feed(content['text'])
+        records = decoder.close()
+        return np.split(records, np.cumsum([size for command, size in requests])[:-1])
+
+    def _put_manifest(self, names):
+        ''' Returns type, element type, shape and size of the C++ variables, collected in a single cell if possible '''
+        try:
+            return self._manifest_entries(names)
+        except (CppExecutionError, ValueError):
+            if len(names) == 1:
+                raise
+        #a name that does not compile or prints something else fails the whole cell, so the variables are asked for one by one
+        manifest = {}
+        for name in names:
+            try:
+                manifest.update(self._manifest_entries([name]))
+            except (CppExecutionError, ValueError) as e:
+                self.sos_kernel.warn(f'Failed to put variable {name} from C++: {e}')
+        return manifest
+
+    def _manifest_entries(self, names):
+        entries = ' std::cout << ",";'.join(f' sos_manifest_entry("{name}", {name});' for name in names)
+        manifest = json.loads(stitch_cell_output(self._request(f'std::cout << "[";{entries} std::cout << "]";')))
+        for entry in manifest:
+            #quote type names the way xeus-cling displays strings returned by type()
+            for key in ('type', 'element_type', 'key_type', 'value_type'):
+                if entry.get(key) is not None:
+                    entry[key] = f'"{entry[key]}"'
+        return {entry['name']: entry for entry in manifest}
+
+    def _unchanged_in_cpp(self, names):
+        ''' Returns names whose registered value is still held unchanged by the C++ kernel '''
+        if not names:
+            return set()
+        #the registry is empty after a kernel restart, and the digest of what the name holds now changes when the C++
+        #variable is reassigned or redeclared
+        try:
+            valid = stitch_cell_output(self._request(' '.join(f'std::cout << sos_transfer_valid("{name}", {name});' for name in names))).strip()
+        except CppExecutionError:
+            return set()
+        except CppRequestError as e:
+            self.sos_kernel.warn(str(e))
+            return set()
+        if len(valid) != len(names):
+            return set()
+        return {name for name, flag in zip(names, valid) if flag == '1'}
+
     def get_vars(self, names):
+        #the hashes and the cache check are shared by all variables
+        with self._transfer('get', names):
+            self._get_vars(names)
+
+    def _get_vars(self, names):
+        with self._phase('hash'):
+            digests = {name: _content_hash(env.sos_dict[name], self.get_cache_max_bytes) if self.get_cache_size > 0 else None for name in names}
+        cache = self._state.get_cache
+        unchanged = self._unchanged_in_cpp([name for name in names if digests[name] is not None and cache.get(name) == digests[name]])
+        pending = []
         for name in names:
-            # self.sos_kernel.warn(name)
-            cpp_repr = self._Cpp_declare_command_string(name, env.sos_dict[name])
-            # self.sos_kernel.warn(cpp_repr)
-            if not cpp_repr==None:
-                self.sos_kernel.run_cell(cpp_repr, True, False,
-                 on_error=f'Failed to put variable {name} to C++')
+            if name in unchanged:
+                cache.move_to_end(name)
+            else:
+                cache.pop(name, None)
+                pending.append(name)
+        try:
+            if self.get_workers > 0 and len(pending) > 1:
+                self._get_pipelined(pending, digests)
+                return
+            for name in pending:
+                self._get_var(name, digests[name])
+        except CppRequestError as e:
+            #the kernel is not answering, so the remaining variables are not sent either
+            self.sos_kernel.warn(f'Failed to get variables {", ".join(pending)} to C++: {e}')
+
+    def _get_pipelined(self, names, digests):
+        #variables are declared in order, while up to get_workers of the following ones are serialized in the background
+        chunked = {name: self._chunked_type(env.sos_dict[name]) for name in names}
+        following = iter([name for name in names if chunked[name] is None])
+        declarations = {}
+        with ThreadPoolExecutor(max_workers=self.get_workers) as executor:
+            try:
+                for name in names:
+                    for ahead in islice(following, self.get_workers + 1 - len(declarations)):
+                        declarations[ahead] = executor.submit(self._prepare_declaration, ahead, env.sos_dict[ahead])
+                    self._get_var(name, digests[name], declarations.pop(name, None), chunked[name])
+            finally:
+                #drop declarations that were prepared but not executed
+                for declaration in declarations.values():
+                    if declaration.cancel() or declaration.exception() is not None:
+                        continue
+                    cpp_repr, self._staged.files, self._staged.segments, seconds = declaration.result()
+                    self._cleanup_transfer_files(record=False)
+
+    def _prepare_declaration(self, name, obj):
+        ''' Serializes a variable in a pipeline worker, returning its declaration with the files and segments it uses '''
+        start = time.perf_counter()
+        try:
+            cpp_repr = self._Cpp_declare_command_string(name, obj)
+            return cpp_repr, self._staged.files, self._staged.segments, time.perf_counter() - start
+        except BaseException:
+            self._cleanup_transfer_files(record=False)
+            raise
+        finally:
+            self._staged.files, self._staged.segments = [], []
+
+    def _chunked_type(self, obj):
+        ''' Returns the C++ element type of an array moved in blocks of chunk_size bytes, or None if it is declared in one cell '''
+        if isinstance(obj, np.ndarray) and obj.nbytes > self.chunk_size and not self._use_shared_memory() and obj.dtype.kind in 'biuf':
+            cpp_type = _sos_to_cpp_dtype(obj, self._chunk_elements(obj.dtype))
+            if cpp_type in _cpp_numpy_dtypes:
+                return cpp_type
+        return None
+
+    def _get_var(self, name, digest, declaration=None, chunked_type=None):
+        with self._transfer('get', name):
+            try:
+                self._declare_var(name, digest, declaration, chunked_type)
+            except CppRequestError:
+                raise
+            except Exception as e:
+                self.sos_kernel.warn(f'Failed to get variable {name} to C++: {e}')
+            finally:
+                self._cleanup_transfer_files()
+
+    def _declare_var(self, name, digest, declaration, chunked_type):
+        # self.sos_kernel.warn(name)
+        obj = env.sos_dict[name]
+        if declaration is None and chunked_type is None:
+            chunked_type = self._chunked_type(obj)
+        if declaration is not None:
+            cpp_repr, self._staged.files, self._staged.segments, seconds = declaration.result()
+            if self._record is not None:
+                self._record.add_time('serialize', seconds)
+        elif chunked_type is not None:
+            self._get_chunked(name, obj, chunked_type)
+            cpp_repr = ''
+            if digest is not None:
+                cpp_repr = f'sos_register_transfer("{name}", {name});'
+        else:
+            with self._phase('serialize'):
+                cpp_repr = self._Cpp_declare_command_string(name, obj)
+        # self.sos_kernel.warn(cpp_repr)
+        if not cpp_repr==None:
+            if cpp_repr and digest is not None and 'sos_register_transfer' not in cpp_repr:
+                cpp_repr += f' sos_register_transfer("{name}", {name});'
+            if cpp_repr:
+                self._run_cell(cpp_repr, on_error=f'Failed to put variable {name} to C++')
+            if cpp_repr and digest is not None:
+                cache = self._state.get_cache
+                cache[name] = digest
+                while len(cache) > self.get_cache_size or sum(nbytes for hashed, nbytes in cache.values()) > self.get_cache_max_bytes:
+                    cache.popitem(last=False)
 
     def put_vars(self, names, to_kernel=None):
         result = {}
+        if not names:
+            return result
+        #the manifest is shared by all variables, and each batched cell by the variables it moves
+        with self._transfer('put', names):
+            try:
+                manifest = self._put_manifest(names)
+            except (CppRequestError, ValueError) as e:
+                self.sos_kernel.warn(f'Failed to put variables {", ".join(names)} from C++: {e}')
+                return result
+            names = [name for name in names if name in manifest]
+            if self._record is not None:
+                self._record.batch_names = list(names)
+            try:
+                if self.lazy_put_threshold is not None and to_kernel in (None, 'SoS'):
+                    self._put_proxies(names, manifest, result)
+                batched = [name for name in names if name not in result]
+                with self._transfer('put', batched):
+                    self._put_batched(batched, manifest, result)
+                    if self._record is not None:
+                        self._record.batch_names = [name for name in batched if name in result]
+            except CppRequestError as e:
+                self.sos_kernel.warn(f'Failed to put variables {", ".join(names)} from C++: {e}')
+                return result
+            except (ValueError, IndexError):
+                #output that cannot be decoded fails the whole batch, whose variables are then put one by one
+                pass
+            for name in names:
+                # name - string with variable name (in C++)
+                if name in result:
+                    continue
+                with self._transfer('put', name):
+                    try:
+                        self._put_var(name, manifest[name], result)
+                    except (CppRequestError, ValueError, IndexError) as e:
+                        self.sos_kernel.warn(f'Failed to put variable {name} from C++: {e}')
+        return {name: result[name] for name in names if name in result}
+
+    def _put_proxies(self, names, manifest, result):
+        #large arrays stay in C++ and are fetched region by region through a proxy
         for name in names:
-            # name - string with variable name (in C++)
-            cpp_type = self.insistent_get_response(f'type({name})', ('execute_result',))[0][1]['data']['text/plain']
-
-            if cpp_type in ('"int"', '"short"', '"long"', '"long long"', '"float"', '"double"', '"long double"', '"char"', '"bool"', '"std::_Bit_reference"', '"std::__cxx11::basic_string<char, std::char_traits<char>, std::allocator<char> >"'):
-                #do scalar conversion
-                value = self.insistent_get_response(f'std::cout<<{name};', ('stream',))[0][1]['text']
-                result[name] = _cpp_scalar_to_sos(cpp_type, value)
-
-            elif cpp_type.startswith('"std::map'):
-                #convert map to a dict of strings
-                value = '{' + self.insistent_get_response(f'for (auto it={name}.begin(); it!={name}.end(); ++it) std::cout << "\\"" << it->first << "\\":\\"" << it->second << "\\",";', ('stream',))[0][1]['text'] + '}'
-                temp_dict = dict(eval(value))
-                #convert string to appropriate Python types
-                key_cpp_type = self.insistent_get_response(f'type({name}.begin()->first)', ('execute_result',))[0][1]['data']['text/plain']
-                val_cpp_type = self.insistent_get_response(f'type({name}.begin()->second)', ('execute_result',))[0][1]['data']['text/plain']
-                result[name] = dict({_cpp_scalar_to_sos(key_cpp_type, key) : _cpp_scalar_to_sos(val_cpp_type, val) for (key, val) in temp_dict.items()})
-
-            elif cpp_type.startswith('"std::vector'):
-                #convert std::vector to array of strings which hold variable values
-                flat_list = '[' + self.insistent_get_response(f'for(auto it={name}.begin(); it!={name}.end(); ++it) std::cout << "\\"" << *it << "\\",";', ('stream',))[0][1]['text'] + ']'
-                el_type = self.insistent_get_response(f'type(*{name}.begin())', ('execute_result',))[0][1]['data']['text/plain']
-                result[name] = np.array([_cpp_scalar_to_sos(el_type, el) for el in eval(flat_list)])
-
-            elif cpp_type.startswith('"xt::xarray_container') or cpp_type.startswith('"xt::xfunction'):
-                #convert xarray
-                # flat_array = eval(self.sos_kernel.get_response(f'std::cout<<xt::flatten({name});', ('stream',))[0][1]['text'].replace('{','[').replace('}',']'))
-                flat_list = '[' + self.insistent_get_response(f'for(auto it={name}.begin(); it!={name}.end(); ++it) std::cout << "\\"" << *it << "\\",";', ('stream',))[0][1]['text'] + ']'
-                # self.sos_kernel.warn(eval(flat_list))
-                shape = eval('(' + self.insistent_get_response(f'for (auto& el : {name}.shape()) {{std::cout << el << ", "; }}', ('stream',))[0][1]['text'] + ')')  #https://github.com/QuantStack/xtensor/issues/1247
-                el_type = self.insistent_get_response(f'type(*{name}.begin())', ('execute_result',))[0][1]['data']['text/plain']
-                result[name] = np.array([_cpp_scalar_to_sos(el_type, el) for el in eval(flat_list)]).reshape(shape)
-
-            elif cpp_type.startswith('"xf::xvariable_container'):
-                #convert xframe to pd.dataframe
-                flat_list = eval( '[' + stitch_cell_output(self.insistent_get_response(f'for(auto it={name}.data().begin(); it!={name}.data().end(); ++it) std::cout << "\\"" << *it << "\\",";', ('stream',))) + ']' )
-                shape = eval('(' + stitch_cell_output(self.insistent_get_response(f'for (auto& el : {name}.shape()) {{std::cout << el << ", "; }}', ('stream',))) + ')')
-                el_type = self.insistent_get_response(f'type(*{name}.data().begin())', ('execute_result',))[0][1]['data']['text/plain']
-                column_labels = eval('[' + stitch_cell_output( self.insistent_get_response(f'print_dataframe_indices({name},1)', ('stream',)) ) + ']')
-                row_labels = eval('[' + stitch_cell_output( self.insistent_get_response(f'print_dataframe_indices({name},0)', ('stream',)) ) + ']')
-                result[name] = pd.DataFrame(np.array([_cpp_scalar_to_sos(el_type, el) for el in flat_list]).reshape(shape), columns=column_labels, index=row_labels )
+            entry = manifest[name]
+            if entry['type'].startswith(('"xt::xarray_container', '"xt::xarray_adaptor')) and entry['element_type'] in _binary_put_types and entry['shape']:
+                dtype = np.dtype(_binary_put_types[entry['element_type']])
+                if entry['size'] * dtype.itemsize > self.lazy_put_threshold:
+                    result[name] = CppArrayProxy(self, name, entry['shape'], dtype, self.proxy_cache_bytes)
 
-            else:
-                self.sos_kernel.warn(f'Type {cpp_type} is not supported')
-        return result
+    def _put_batched(self, names, manifest, result):
+        #fetch all scalars with one cell, printed as separate records
+        scalars = [name for name in names if manifest[name]['type'] in _scalar_put_types]
+        if scalars:
+            values = self._decode_records(' '.join(f'sos_print_record({name});' for name in scalars), len(scalars))
+            for name, value in zip(scalars, values):
+                result[name] = _cpp_scalar_to_sos(manifest[name]['type'], value)
+
+        #fetch nested vectors of numeric types in CSR form, and maps of numbers and strings as two columns, with one cell each
+        if self.binary_put:
+            result.update(self._map_put_values(manifest, [name for name in names if manifest[name]['type'].startswith(_map_put_types) and manifest[name]['key_type'] in _column_put_types and manifest[name]['value_type'] in _column_put_types]))
+            result.update(self._csr_put_values(manifest, [name for name in names if manifest[name]['type'].startswith('"std::vector<std::vector<') and _nested_element_type(manifest[name]) in _binary_put_types]))
+
+        #hand numeric arrays over through shared memory when enabled
+        if self.binary_put and self._use_shared_memory():
+            result.update(self._shm_put_values(manifest, [name for name in names if manifest[name]['type'].startswith(_array_put_types) and manifest[name]['element_type'] in _binary_put_types]))
+
+        #fetch numeric arrays larger than chunk_size block by block, and all others with one cell of binary dumps
+        elif self.binary_put:
+            binaries = [name for name in names if manifest[name]['type'].startswith(_array_put_types) and manifest[name]['element_type'] in _binary_put_types]
+            chunked = [name for name in binaries if manifest[name]['type'].startswith(_chunked_put_types) and not manifest[name]['type'].startswith('"std::vector<bool') and manifest[name]['size'] * np.dtype(_binary_put_types[manifest[name]['element_type']]).itemsize > self.chunk_size]
+            for name in chunked:
+                self._instantiate('sos_dump_chunk', manifest[name])
+                value = self._put_chunked(name, tuple(manifest[name]['shape']), manifest[name]['element_type'])
+                if value is not None:
+                    result[name] = value
+            result.update(self._binary_put_values([name for name in binaries if name not in chunked]))
+
+    def _put_var(self, name, entry, result):
+        cpp_type = entry['type']
+
+        if cpp_type in _scalar_put_types:
+            result[name] = _cpp_scalar_to_sos(cpp_type, self._decode_records(f'sos_print_record({name});', 1)[0])
+
+        elif cpp_type.startswith(_map_put_types):
+            #keys and values are printed as alternating records
+            self._instantiate('sos_print_elements', entry)
+            records = self._decode_records(f'sos_print_elements({name});', 2 * entry['size'])
+            key_cpp_type = entry['key_type']
+            val_cpp_type = entry['value_type']
+            result[name] = dict({_cpp_scalar_to_sos(key_cpp_type, key) : _cpp_scalar_to_sos(val_cpp_type, val) for (key, val) in zip(records[0::2], records[1::2])})
+
+        elif cpp_type.startswith('"std::vector<std::vector<'):
+            #nested vectors are printed as CSR offsets followed by their concatenated values
+            offsets = self._decode_records(f'sos_print_offsets({name});', entry['size'] + 1, '"long"').astype(np.intp)
+            values = self._decode_records(f'sos_print_elements({name});', int(offsets[-1]), _nested_element_type(entry))
+            result[name] = np.split(values, offsets[1:-1]) if entry['size'] else []
+
+        elif cpp_type.startswith('"std::vector'):
+            self._instantiate('sos_print_elements', entry)
+            result[name] = self._decode_records(f'sos_print_elements({name});', entry['size'], entry['element_type'])
+
+        elif cpp_type.startswith(('"xt::xarray_container', '"xt::xarray_adaptor', '"xt::xfunction')):
+            #https://github.com/QuantStack/xtensor/issues/1247
+            self._instantiate('sos_print_elements', entry)
+            result[name] = self._decode_records(f'sos_print_elements({name});', entry['size'], entry['element_type']).reshape(entry['shape'])
+
+        elif cpp_type.startswith(('"sos_compressed_matrix<', '"sos_coo_matrix<')):
+            value = self._put_sparse(name, cpp_type)
+            if value is not None:
+                result[name] = value
+
+        elif cpp_type.startswith('"xf::xvariable_container'):
+            #convert xframe to pd.dataframe
+            shape = entry['shape']
+            self._instantiate('sos_print_labels', entry)
+            column_labels, row_labels = (labels.tolist() for labels in self._decode_records_many([(f'sos_print_labels({name}, 1);', shape[1]), (f'sos_print_labels({name}, 0);', shape[0])]))
+            el_type = entry['element_type']
+            if self.binary_put and el_type in _binary_put_types:
+                #dump every column as its own contiguous buffer
+                paths = [self._transfer_file() for col in column_labels]
+                self._run_cell(' '.join(f'dump_npy_buffer("{path}", xt::view({name}.data(), xt::all(), {col}));' for col, path in enumerate(paths)), on_error=f'Failed to dump variable {name} from C++')
+                try:
+                    if all(os.path.exists(path) for path in paths):
+                        with self._phase('decode'):
+                            result[name] = pd.DataFrame({label: np.load(path) for label, path in zip(column_labels, paths)}, columns=column_labels, index=row_labels)
+                        return
+                finally:
+                    self._cleanup_transfer_files()
+            self._instantiate('sos_print_elements', entry)
+            values = self._decode_records(f'sos_print_elements({name});', entry['size'], el_type).reshape(shape)
+            result[name] = pd.DataFrame(values, columns=column_labels, index=row_labels )
+
+        else:
+            self.sos_kernel.warn(f'Type {cpp_type} is not supported')
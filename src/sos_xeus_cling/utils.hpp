@@ -1,14 +1,27 @@
+//Helpers for variable transfer that only need the standard library, included when the C++ subkernel starts.
+//xtensor_utils.hpp and xframe_utils.hpp are included by sos_xeus_cling the first time a transfer needs them.
+#pragma once
 #include <iostream>
+#include <string>
+#include <vector>
+#include <limits>
+#include <algorithm>
 #include <typeinfo>
 #include <cstdlib>
 #include <memory>
 #include <cxxabi.h>
-#include "xtensor/xarray.hpp"
-#include "xtensor/xio.hpp"
-#include "xtensor/xview.hpp"
-#include "xtensor/xrandom.hpp"
-#include "xframe/xio.hpp"
-#include "xframe/xvariable.hpp"
+#include <fstream>
+#include <type_traits>
+#include <functional>
+#include <map>
+#include <unordered_map>
+#include <utility>
+#include <numeric>
+#include <stdexcept>
+#include <cstring>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <unistd.h>
 
 std::string demangle(const char* name) {
     int status = -4; // some arbitrary value to eliminate the compiler warning
@@ -34,16 +47,474 @@ template<class T> std::string type(const T& t) {
 //        void *: "pointer to void",                int *: "pointer to int",         \
 //       default: "other")
 
-//Print row and column labels of xframe
-//Rework of view function from here: https://github.com/QuantStack/xframe/blob/e16299b1f572a98e4ac77010f646c0f99cf3e855/include/xframe/xio.hpp#L26 
-template <class T> 
-void print_dataframe_indices(const T& expr, const int& dim)
+//Print values as records terminated by the ASCII record separator for text %put.
+//Backslashes and separators inside strings are escaped, so records can be split across stream messages safely.
+template <class T>
+void sos_print_record(const T& value)
 {
-    const auto& dim_name = expr.dimension_mapping().labels()[dim];
+    std::cout << value << '\x1e';
+}
+
+inline void sos_print_record(const std::string& value)
+{
+    for (char c : value)
+    {
+        if (c == '\\')
+            std::cout << "\\\\";
+        else if (c == '\x1e')
+            std::cout << "\\e";
+        else
+            std::cout << c;
+    }
+    std::cout << '\x1e';
+}
+
+template <class K, class V>
+void sos_print_record(const std::pair<K, V>& value)
+{
+    sos_print_record(value.first);
+    sos_print_record(value.second);
+}
+
+//Elements of nested vectors are printed one after another, so nested containers print their concatenated values
+template <class T, class A>
+void sos_print_record(const std::vector<T, A>& value)
+{
+    for (const auto& el : value)
+    {
+        sos_print_record(el);
+    }
+}
+
+template <class C>
+auto sos_print_elements(const C& container, int) -> decltype(container.data().begin(), void())
+{
+    for (const auto& el : container.data())
+    {
+        sos_print_record(el);
+    }
+}
+
+template <class C>
+void sos_print_elements(const C& container, long)
+{
+    for (const auto& el : container)
+    {
+        sos_print_record(el);
+    }
+}
+
+template <class C>
+void sos_print_elements(const C& container)
+{
+    sos_print_elements(container, 0);
+}
+
+//Manifest of a variable for %put, printed as a JSON object with its type, element type, shape and size
+template <class T>
+auto sos_manifest_shape(const T& t, int) -> decltype(t.shape(), void())
+{
+    std::size_t size = 1;
+    std::cout << ",\"shape\":[";
+    for (std::size_t i = 0; i < t.shape().size(); ++i)
+    {
+        std::cout << (i ? "," : "") << t.shape()[i];
+        size *= t.shape()[i];
+    }
+    std::cout << "],\"size\":" << size;
+}
+
+template <class T>
+auto sos_manifest_shape(const T& t, long) -> decltype(t.size(), void())
+{
+    std::cout << ",\"shape\":[" << t.size() << "],\"size\":" << t.size();
+}
+
+template <class T>
+void sos_manifest_shape(const T&, ...)
+{
+    std::cout << ",\"shape\":null,\"size\":null";
+}
+
+template <class T>
+auto sos_manifest_element(const T& t, int) -> decltype(t.data().begin(), void())
+{
+    std::cout << ",\"element_type\":\"" << demangle(typeid(typename std::decay<decltype(*t.data().begin())>::type).name()) << "\"";
+}
+
+template <class T>
+auto sos_manifest_element(const T& t, long) -> decltype(t.begin(), void())
+{
+    std::cout << ",\"element_type\":\"" << demangle(typeid(typename std::decay<decltype(*t.begin())>::type).name()) << "\"";
+}
+
+template <class T>
+void sos_manifest_element(const T&, ...)
+{
+    std::cout << ",\"element_type\":null";
+}
+
+template <class T>
+auto sos_manifest_mapping(const T&, int) -> decltype(std::declval<typename T::key_type>(), std::declval<typename T::mapped_type>(), void())
+{
+    std::cout << ",\"key_type\":\"" << demangle(typeid(typename T::key_type).name()) << "\",\"value_type\":\"" << demangle(typeid(typename T::mapped_type).name()) << "\"";
+}
+
+template <class T>
+void sos_manifest_mapping(const T&, ...)
+{
+}
+
+template <class T>
+void sos_manifest_entry(const std::string& name, const T& t)
+{
+    std::cout << "{\"name\":\"" << name << "\",\"type\":\"" << type(t) << "\"";
+    sos_manifest_element(t, 0);
+    sos_manifest_mapping(t, 0);
+    sos_manifest_shape(t, 0);
+    std::cout << "}";
+}
+
+//Read or write a block of raw elements of a contiguous container for chunked transfer
+template <class C>
+void sos_load_chunk(C& container, std::size_t offset, const std::string& path)
+{
+    std::ifstream in(path, std::ios::binary | std::ios::ate);
+    std::streamsize bytes = in.tellg();
+    in.seekg(0);
+    in.read(reinterpret_cast<char*>(container.data() + offset), bytes);
+}
+
+template <class C>
+void sos_dump_chunk(const C& container, std::size_t offset, std::size_t count, const std::string& path)
+{
+    std::ofstream out(path, std::ios::binary);
+    out.write(reinterpret_cast<const char*>(container.data() + offset), count * sizeof(*container.data()));
+}
+
+//Nested vectors are transferred in CSR form: offsets of the inner vectors into their concatenated values
+template <class T>
+std::vector<T> sos_read_buffer(const std::string& path)
+{
+    std::ifstream in(path, std::ios::binary | std::ios::ate);
+    std::vector<T> buffer(static_cast<std::size_t>(in.tellg()) / sizeof(T));
+    in.seekg(0);
+    in.read(reinterpret_cast<char*>(buffer.data()), buffer.size() * sizeof(T));
+    return buffer;
+}
+
+//bools are written by numpy as one byte each
+template <>
+inline std::vector<bool> sos_read_buffer<bool>(const std::string& path)
+{
+    std::vector<unsigned char> buffer = sos_read_buffer<unsigned char>(path);
+    return std::vector<bool>(buffer.begin(), buffer.end());
+}
+
+template <class T, class O, class V>
+std::vector<std::vector<T>> sos_from_csr(const O& offsets, const V& values)
+{
+    std::vector<std::vector<T>> nested;
+    nested.reserve(offsets.size() - 1);
+    for (std::size_t i = 0; i + 1 < offsets.size(); ++i)
+    {
+        nested.emplace_back(values.begin() + offsets[i], values.begin() + offsets[i + 1]);
+    }
+    return nested;
+}
+
+//Strings are transferred as their concatenated bytes and the offsets of each string into them
+template <class B, class O>
+std::vector<std::string> sos_read_strings(const B& bytes, const O& offsets)
+{
+    std::vector<std::string> strings;
+    strings.reserve(offsets.size() - 1);
+    for (std::size_t i = 0; i + 1 < offsets.size(); ++i)
+    {
+        strings.emplace_back(bytes.begin() + offsets[i], bytes.begin() + offsets[i + 1]);
+    }
+    return strings;
+}
+
+//Dicts are transferred as a column of keys and a column of values, zipped into a map in one pass
+template <class K, class V, class KA, class VA>
+std::map<K, V> sos_zip_map(std::vector<K, KA> keys, std::vector<V, VA> values)
+{
+    //inserting in key order lets every element go right before the end hint in constant time
+    std::vector<std::size_t> order(keys.size());
+    std::iota(order.begin(), order.end(), 0);
+    std::sort(order.begin(), order.end(), [&keys](std::size_t a, std::size_t b) { return keys[a] < keys[b]; });
+    std::map<K, V> map;
+    for (std::size_t i : order)
+    {
+        map.emplace_hint(map.end(), std::move(keys[i]), std::move(values[i]));
+    }
+    return map;
+}
+
+template <class K, class V, class KA, class VA>
+std::unordered_map<K, V> sos_zip_unordered_map(std::vector<K, KA> keys, std::vector<V, VA> values)
+{
+    std::unordered_map<K, V> map;
+    map.reserve(keys.size());
+    for (std::size_t i = 0; i < keys.size(); ++i)
+    {
+        map.emplace(std::move(keys[i]), std::move(values[i]));
+    }
+    return map;
+}
 
-    for (std::size_t row_idx = 0; row_idx < expr.shape()[dim]; ++row_idx)
+template <class T, class A, class B>
+void sos_print_offsets(const std::vector<std::vector<T, A>, B>& nested)
+{
+    std::size_t offset = 0;
+    sos_print_record(offset);
+    for (const auto& inner : nested)
+    {
+        offset += inner.size();
+        sos_print_record(offset);
+    }
+}
+
+template <class T, class A, class B>
+void sos_dump_csr(const std::vector<std::vector<T, A>, B>& nested, const std::string& offsets_path, const std::string& values_path)
+{
+    //std::vector<bool> is bit-packed, so bools are written as one byte each
+    std::vector<std::size_t> offsets(1, 0);
+    std::vector<typename std::conditional<std::is_same<T, bool>::value, unsigned char, T>::type> values;
+    offsets.reserve(nested.size() + 1);
+    for (const auto& inner : nested)
+    {
+        offsets.push_back(offsets.back() + inner.size());
+    }
+    values.reserve(offsets.back());
+    for (const auto& inner : nested)
+    {
+        values.insert(values.end(), inner.begin(), inner.end());
+    }
+    std::ofstream(offsets_path, std::ios::binary).write(reinterpret_cast<const char*>(offsets.data()), offsets.size() * sizeof(std::size_t));
+    std::ofstream(values_path, std::ios::binary).write(reinterpret_cast<const char*>(values.data()), values.size() * sizeof(values[0]));
+}
+
+//Sparse matrices in the compressed row, compressed column and coordinate forms of scipy.sparse,
+//holding only the stored elements and their indices; Rows tells compressed rows from compressed columns
+template <class T, bool Rows>
+struct sos_compressed_matrix
+{
+    std::size_t rows;
+    std::size_t cols;
+    std::vector<T> data;
+    std::vector<std::size_t> indices;
+    std::vector<std::size_t> indptr;
+};
+
+template <class T>
+using sos_csr_matrix = sos_compressed_matrix<T, true>;
+
+template <class T>
+using sos_csc_matrix = sos_compressed_matrix<T, false>;
+
+template <class T>
+struct sos_coo_matrix
+{
+    std::size_t rows;
+    std::size_t cols;
+    std::vector<T> data;
+    std::vector<std::size_t> row;
+    std::vector<std::size_t> col;
+};
+
+template <class T, class A>
+void sos_write_buffer(const std::vector<T, A>& values, const std::string& path)
+{
+    std::ofstream(path, std::ios::binary).write(reinterpret_cast<const char*>(values.data()), values.size() * sizeof(T));
+}
+
+//std::vector<bool> is bit-packed, so bools are written as one byte each
+template <class A>
+void sos_write_buffer(const std::vector<bool, A>& values, const std::string& path)
+{
+    std::vector<unsigned char> buffer(values.begin(), values.end());
+    sos_write_buffer(buffer, path);
+}
+
+//Write the arrays of a sparse matrix as raw buffers for %put and print its shape as records
+template <class T, bool Rows>
+void sos_dump_sparse(const sos_compressed_matrix<T, Rows>& m, const std::string& data_path, const std::string& indices_path, const std::string& indptr_path)
+{
+    sos_write_buffer(m.data, data_path);
+    sos_write_buffer(m.indices, indices_path);
+    sos_write_buffer(m.indptr, indptr_path);
+    sos_print_record(m.rows);
+    sos_print_record(m.cols);
+}
+
+template <class T>
+void sos_dump_sparse(const sos_coo_matrix<T>& m, const std::string& data_path, const std::string& row_path, const std::string& col_path)
+{
+    sos_write_buffer(m.data, data_path);
+    sos_write_buffer(m.row, row_path);
+    sos_write_buffer(m.col, col_path);
+    sos_print_record(m.rows);
+    sos_print_record(m.cols);
+}
+
+//Write the keys and values of a map as two columns for %put, strings as their concatenated bytes and offsets
+template <class T, class A>
+void sos_dump_column(const std::vector<T, A>& values, const std::string& path, const std::string&)
+{
+    sos_write_buffer(values, path);
+}
+
+inline void sos_dump_column(const std::vector<std::string>& values, const std::string& path, const std::string& offsets_path)
+{
+    std::vector<std::size_t> offsets(1, 0);
+    offsets.reserve(values.size() + 1);
+    std::ofstream out(path, std::ios::binary);
+    for (const auto& value : values)
+    {
+        out.write(value.data(), value.size());
+        offsets.push_back(offsets.back() + value.size());
+    }
+    sos_write_buffer(offsets, offsets_path);
+}
+
+template <class M>
+void sos_dump_map(const M& map, const std::string& keys_path, const std::string& key_offsets_path, const std::string& values_path, const std::string& value_offsets_path)
+{
+    std::vector<typename M::key_type> keys;
+    std::vector<typename M::mapped_type> values;
+    keys.reserve(map.size());
+    values.reserve(map.size());
+    for (const auto& item : map)
+    {
+        keys.push_back(item.first);
+        values.push_back(item.second);
+    }
+    sos_dump_column(keys, keys_path, key_offsets_path);
+    sos_dump_column(values, values_path, value_offsets_path);
+}
+
+//Digest of the value of a variable, used by %get to check whether C++ still holds the transferred value
+inline void sos_digest_combine(std::size_t& seed, std::size_t value)
+{
+    seed ^= value + 0x9e3779b9 + (seed << 6) + (seed >> 2);
+}
+
+template <class T>
+auto sos_digest(const T& t, int) -> decltype(std::hash<T>()(t))
+{
+    return std::hash<T>()(t);
+}
+
+template <class K, class V>
+std::size_t sos_digest(const std::pair<K, V>& p, int)
+{
+    std::size_t seed = sos_digest(p.first, 0);
+    sos_digest_combine(seed, sos_digest(p.second, 0));
+    return seed;
+}
+
+template <class T>
+auto sos_digest(const T& t, long) -> decltype(t.begin(), t.end(), std::size_t())
+{
+    std::size_t seed = 0;
+    for (const auto& el : t)
+    {
+        sos_digest_combine(seed, sos_digest(el, 0));
+    }
+    return seed;
+}
+
+template <class T>
+auto sos_digest(const T& t, ...) -> decltype(t.data().begin(), std::size_t())
+{
+    return sos_digest(t.data(), 0);
+}
+
+template <class M>
+std::size_t sos_digest_sparse(const M& m, const std::vector<std::size_t>& first, const std::vector<std::size_t>& second)
+{
+    std::size_t seed = sos_digest(m.data, 0);
+    sos_digest_combine(seed, sos_digest(first, 0));
+    sos_digest_combine(seed, sos_digest(second, 0));
+    sos_digest_combine(seed, m.rows);
+    sos_digest_combine(seed, m.cols);
+    return seed;
+}
+
+template <class T, bool Rows>
+std::size_t sos_digest(const sos_compressed_matrix<T, Rows>& m, int)
+{
+    return sos_digest_sparse(m, m.indices, m.indptr);
+}
+
+template <class T>
+std::size_t sos_digest(const sos_coo_matrix<T>& m, int)
+{
+    return sos_digest_sparse(m, m.row, m.col);
+}
+
+//Only digests are registered, since a name can be redeclared as a new variable that the registered one knows nothing about
+std::map<std::string, std::size_t> sos_transfer_registry;
+
+template <class T>
+std::size_t sos_transfer_digest(const T& t)
+{
+    std::size_t seed = sos_digest(t, 0);
+    sos_digest_combine(seed, typeid(T).hash_code());
+    return seed;
+}
+
+template <class T>
+void sos_register_transfer(const std::string& name, const T& t)
+{
+    sos_transfer_registry[name] = sos_transfer_digest(t);
+}
+
+template <class T>
+bool sos_transfer_valid(const std::string& name, const T& t)
+{
+    auto it = sos_transfer_registry.find(name);
+    return it != sos_transfer_registry.end() && it->second == sos_transfer_digest(t);
+}
+
+//Copy contiguous data into a new POSIX shared memory segment, which SoS maps as a numpy array and unlinks
+template <class T>
+void sos_shm_export(const std::string& segment, const T* data, std::size_t size)
+{
+    std::size_t bytes = size * sizeof(T);
+    int fd = shm_open(segment.c_str(), O_CREAT | O_EXCL | O_RDWR, 0600);
+    if (fd == -1)
+        throw std::runtime_error("Cannot create shared memory segment " + segment);
+    if (ftruncate(fd, bytes) == -1)
     {
-        xtl::visit([](auto&& arg) { std::cout << "\"" << arg << "\","; }, expr.coordinates()[dim_name].label(row_idx));
+        close(fd);
+        shm_unlink(segment.c_str());
+        throw std::runtime_error("Cannot resize shared memory segment " + segment);
     }
+    void* addr = mmap(nullptr, bytes, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+    close(fd);
+    if (addr == MAP_FAILED)
+    {
+        shm_unlink(segment.c_str());
+        throw std::runtime_error("Cannot map shared memory segment " + segment);
+    }
+    std::memcpy(addr, data, bytes);
+    munmap(addr, bytes);
+}
 
-}
\ No newline at end of file
+template <class T, class A>
+void sos_shm_export(const std::string& segment, const std::vector<T, A>& vec)
+{
+    sos_shm_export(segment, vec.data(), vec.size());
+}
+
+//std::vector<bool> is bit-packed, so copy it to a contiguous bool array first
+template <class A>
+void sos_shm_export(const std::string& segment, const std::vector<bool, A>& vec)
+{
+    std::unique_ptr<bool[]> buffer(new bool[vec.size()]);
+    std::copy(vec.begin(), vec.end(), buffer.get());
+    sos_shm_export(segment, buffer.get(), vec.size());
+}
@@ -0,0 +1,29 @@
+//Transfer helpers for xframe variables, included on the first transfer of a DataFrame
+#pragma once
+#include "xtensor_utils.hpp"
+#include "xframe/xio.hpp"
+#include "xframe/xvariable.hpp"
+
+//Print row (dim 0) or column (dim 1) labels of xframe as records
+template <class T>
+void sos_print_labels(const T& expr, const int& dim)
+{
+    const auto& dim_name = expr.dimension_mapping().labels()[dim];
+
+    for (std::size_t row_idx = 0; row_idx < expr.shape()[dim]; ++row_idx)
+    {
+        xtl::visit([](auto&& arg) { sos_print_record(arg); }, expr.coordinates()[dim_name].label(row_idx));
+    }
+}
+
+//Axis of many labels read as a std::vector, the same axis xf::axis makes of an initializer list
+template <class L>
+xf::xaxis<L, std::size_t> sos_axis(std::vector<L> labels)
+{
+    return xf::xaxis<L, std::size_t>(std::move(labels));
+}
+
+inline xf::xaxis<xf::fstring, std::size_t> sos_axis(const std::vector<std::string>& labels)
+{
+    return sos_axis(std::vector<xf::fstring>(labels.begin(), labels.end()));
+}
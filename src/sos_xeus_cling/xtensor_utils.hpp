@@ -0,0 +1,64 @@
+//Transfer helpers for xtensor arrays, included on the first transfer of an array
+#pragma once
+#include "utils.hpp"
+#include "xtensor/xarray.hpp"
+#include "xtensor/xtensor.hpp"
+#include "xtensor/xio.hpp"
+#include "xtensor/xnpy.hpp"
+#include "xtensor/xadapt.hpp"
+#include "xtensor/xview.hpp"
+#include "xtensor/xbuilder.hpp"
+#include "xtensor/xrandom.hpp"
+
+//Write contiguous data of std::vector or xtensor expression to .npy file for binary %put
+template <class T, class A>
+void dump_npy_buffer(const std::string& path, const std::vector<T, A>& vec)
+{
+    xt::dump_npy(path, xt::adapt(vec));
+}
+
+//std::vector<bool> is bit-packed, so copy it to a contiguous bool array first
+template <class A>
+void dump_npy_buffer(const std::string& path, const std::vector<bool, A>& vec)
+{
+    xt::xtensor<bool, 1> buffer = xt::empty<bool>({vec.size()});
+    std::copy(vec.begin(), vec.end(), buffer.begin());
+    xt::dump_npy(path, buffer);
+}
+
+template <class E>
+void dump_npy_buffer(const std::string& path, const xt::xexpression<E>& expr)
+{
+    xt::dump_npy(path, xt::eval(expr.derived_cast()));
+}
+
+//Assign column j of 2-D data from a typed 1-D buffer for columnar DataFrame transfer
+template <class T, class C>
+void sos_set_column(xt::xarray<T>& data, std::size_t j, const C& column)
+{
+    xt::view(data, xt::all(), j) = column;
+}
+
+//Map a POSIX shared memory segment filled by SoS as an xtensor adaptor without copying it.
+//The mapping is released with the last copy of the adaptor, and SoS unlinks the segment after the declaration.
+template <class T>
+auto sos_shm_adapt(const std::string& segment, const std::vector<std::size_t>& shape)
+{
+    std::size_t bytes = std::accumulate(shape.begin(), shape.end(), std::size_t(1), std::multiplies<std::size_t>()) * sizeof(T);
+    int fd = shm_open(segment.c_str(), O_RDWR, 0);
+    if (fd == -1)
+        throw std::runtime_error("Cannot open shared memory segment " + segment);
+    void* addr = mmap(nullptr, bytes, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+    close(fd);
+    if (addr == MAP_FAILED)
+        throw std::runtime_error("Cannot map shared memory segment " + segment);
+    std::shared_ptr<void> mapping(addr, [bytes](void* p) { munmap(p, bytes); });
+    return xt::adapt_smart_ptr(static_cast<T*>(addr), shape, mapping);
+}
+
+template <class E>
+void sos_shm_export(const std::string& segment, const xt::xexpression<E>& expr)
+{
+    const auto& values = xt::eval(expr.derived_cast());
+    sos_shm_export(segment, values.data(), values.size());
+}
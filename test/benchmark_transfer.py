@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Konstantin Taletskiy
+# Distributed under the terms of the MIT License.
+
+# Benchmark of %get/%put transfers against the local FakeSoSKernel, so it runs without cling.
+#
+#   python benchmark_transfer.py --max-size 1000000 --output results.json
+#   python benchmark_transfer.py --baseline benchmark_baseline.json
+#
+# Reports latency, throughput and peak Python memory for _Cpp_declare_command_string, get_vars
+# and put_vars, and exits with status 1 when a latency regresses past --tolerance times the baseline.
+# Latencies are compared relative to a fixed reference workload timed next to each operation, so a baseline
+# recorded on one machine holds on another. Regenerate benchmark_baseline.json with
+#
+#   python benchmark_transfer.py --max-size 1e5 --output benchmark_baseline.json
+#
+# Timings vary between runs on a busy machine, so each benchmark keeps its median over --runs passes.
+#
+# With --recording, cells are answered from traffic saved by fake_kernel.RecordingSoSKernel around a real
+# xeus-cling session that transferred a variable named bench, and emulated when they were not recorded.
+# Recorded %put cells do not depend on the size, so put latencies then follow the recorded variable.
+
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from sos.utils import env
+from sos_xeus_cling.kernel import sos_xeus_cling
+from fake_kernel import FakeSoSKernel, CppVariable
+
+KINDS = ('scalar', 'dict', 'vector', 'ndarray', 'dataframe')
+
+def make_value(kind, size):
+    rng = np.random.default_rng(size)
+    if kind == 'scalar':
+        return 1.5
+    elif kind == 'dict':
+        return dict(zip((f'key{i}' for i in range(size)), rng.random(size).tolist()))
+    elif kind == 'vector':
+        return rng.integers(0, 1000, size).tolist()
+    elif kind == 'ndarray':
+        return rng.random(size)
+    elif kind == 'dataframe':
+        return pd.DataFrame(rng.random((max(1, size // 4), 4)), columns=list('ABCD'))
+
+def make_cpp_variable(kind, value):
+    if kind == 'scalar':
+        return CppVariable('scalar', value, 'double')
+    elif kind == 'dict':
+        return CppVariable('map', value, key_type='std::__cxx11::basic_string<char, std::char_traits<char>, std::allocator<char> >', value_type='double')
+    elif kind == 'vector':
+        return CppVariable('vector', np.asarray(value, dtype=np.int32))
+    elif kind == 'ndarray':
+        return CppVariable('xarray', value)
+    elif kind == 'dataframe':
+        return CppVariable('xframe', value)
+
+def nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    elif isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True).sum())
+    elif isinstance(value, dict):
+        return sum(len(k) + 8 for k in value)
+    elif isinstance(value, list):
+        return 8 * len(value)
+    return 8
+
+def measure(func, repeat, min_time=0.2):
+    ''' Returns best wall time of func over at least repeat runs lasting min_time seconds and peak traced memory of one more run '''
+    best = None
+    runs = 0
+    total = 0.0
+    #fast operations are repeated until min_time so their best time is not dominated by noise, and like timeit
+    #garbage collection is paused so that collections triggered by earlier benchmarks are not timed
+    gc.collect()
+    gc.disable()
+    try:
+        while runs < repeat or total < min_time:
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+            runs += 1
+            total += elapsed
+    finally:
+        gc.enable()
+    #tracing slows allocations down, so memory is measured separately from latency
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+def reference(repeat):
+    ''' Returns best wall time of a fixed Python and NumPy workload that does not depend on sos-xeus-cling '''
+    values = np.random.default_rng(0).random(100000)
+    return measure(lambda: (np.sort(values), json.dumps(values[:10000].tolist()), sum(range(100000))), repeat)[0]
+
+def run(kinds, sizes, repeat, recording=None):
+    results = {}
+    for kind in kinds:
+        for size in (sizes if kind != 'scalar' else [1]):
+            value = make_value(kind, size)
+            env.sos_dict.set('bench', value)
+            data_bytes = nbytes(value)
+
+            module = sos_xeus_cling(FakeSoSKernel(recording=recording, evaluate=False))
+            module.get_cache_size = 0
+            operations = {
+                'declare': lambda: (module._Cpp_declare_command_string('bench', value), module._cleanup_transfer_files()),
+                'get': lambda: module.get_vars(['bench']),
+            }
+            put_module = sos_xeus_cling(FakeSoSKernel({'bench': make_cpp_variable(kind, value)}, recording=recording))
+            operations['put'] = lambda: put_module.put_vars(['bench'])
+
+            for op, func in operations.items():
+                #the reference is timed right before each operation to follow changes in machine load during the run
+                reference_latency = reference(repeat)
+                latency, peak = measure(func, repeat)
+                results[f'{kind}/{size}/{op}'] = {'latency': latency, 'relative_latency': latency / reference_latency, 'throughput': data_bytes / latency if latency else None, 'peak_memory': peak}
+                print(f'{kind:>10} {size:>9} {op:>8} {latency * 1000:12.3f} ms {data_bytes / latency / 1e6 if latency else 0:10.2f} MB/s {peak / 1e6:10.2f} MB peak', flush=True)
+    return results
+
+def median_run(runs):
+    ''' Returns the results of the run with the median relative latency for every benchmark '''
+    return {key: sorted((results[key] for results in runs), key=lambda stats: stats['relative_latency'])[len(runs) // 2] for key in runs[0]}
+
+def compare(results, baseline, tolerance):
+    ''' Returns descriptions of the benchmarks whose latency relative to the reference exceeds tolerance times the baseline '''
+    regressions = []
+    for key, stats in results.items():
+        if key in baseline and stats['relative_latency'] > tolerance * baseline[key]['relative_latency']:
+            regressions.append(f'{key}: {stats["relative_latency"]:.3f} x reference, baseline {baseline[key]["relative_latency"]:.3f} x reference')
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark sos-xeus-cling variable transfer against a fake xeus-cling kernel')
+    parser.add_argument('--kinds', nargs='+', choices=KINDS, default=list(KINDS))
+    parser.add_argument('--max-size', type=float, default=1e5, help='largest number of elements, sizes are powers of ten from 1 (up to 1e7)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--runs', type=int, default=3, help='number of passes over all benchmarks, each benchmark keeps its median')
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--baseline', help='compare against results saved with --output')
+    parser.add_argument('--recording', help='replay cells recorded with fake_kernel.RecordingSoSKernel')
+    parser.add_argument('--tolerance', type=float, default=2.0, help='allowed ratio of relative latency against the baseline')
+    args = parser.parse_args()
+
+    sizes = [10 ** i for i in range(int(np.log10(args.max_size)) + 1)]
+    results = median_run([run(args.kinds, sizes, args.repeat, args.recording) for i in range(args.runs)])
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=1, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), args.tolerance)
+        for regression in regressions:
+            print(f'Regression {regression}')
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Konstantin Taletskiy
+# Distributed under the terms of the MIT License.
+
+# Local stand-in for the SoS kernel driving a xeus-cling subkernel. It understands the C++ cells
+# generated by sos_xeus_cling (declarations, manifests, record printing and binary dumps), so
+# transfers can be exercised and benchmarked without cling. Traffic recorded from a real session
+# with RecordingSoSKernel can be replayed, falling back to emulation for unrecorded cells.
+
+import ast
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+import numpy as np
+import pandas as pd
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+_string_type = 'std::__cxx11::basic_string<char, std::char_traits<char>, std::allocator<char> >'
+
+# demangled C++ names of the element types produced by %get declarations and numpy dtypes
+_cpp_names = {'int': 'int', 'long int': 'long', 'float': 'float', 'double': 'double', 'long double': 'long double', 'bool': 'bool', 'std::string': _string_type}
+_dtype_names = {'b': 'bool', 'i1': 'signed char', 'i2': 'short', 'i4': 'int', 'i8': 'long', 'u1': 'unsigned char', 'u2': 'unsigned short',
+    'u4': 'unsigned int', 'u8': 'unsigned long', 'f4': 'float', 'f8': 'double', 'f16': 'long double'}
+_put_dtypes = {name: np.dtype('?' if code == 'b' else code) for code, name in _dtype_names.items()}
+_numpy_types = {'int': np.int32, 'long int': np.int64, 'float': np.float32, 'double': np.float64, 'long double': np.longdouble, 'bool': np.bool_, 'std::string': object}
+
+_temp_path = re.compile(r'"([^"]*sos_xeus_cling_[^"]*|/sos_[0-9a-f]{24})"')
+
+def normalize_code(code):
+    ''' Replaces temporary file and shared memory segment names, which differ between sessions, so recorded cells can be matched '''
+    return _temp_path.sub('"<path>"', code)
+
+def _read_output(path):
+    ''' Returns the content of a temporary file or shared memory segment, or None if it does not exist '''
+    if path.startswith('/sos_'):
+        try:
+            segment = shared_memory.SharedMemory(name=path[1:])
+        except (FileNotFoundError, AttributeError):
+            return None
+        data = bytes(segment.buf)
+        segment.close()
+        return data
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as output:
+        return output.read()
+
+def _write_output(path, data):
+    if path.startswith('/sos_'):
+        segment = shared_memory.SharedMemory(name=path[1:], create=True, size=len(data))
+        segment.buf[:len(data)] = data
+        segment.close()
+    else:
+        with open(path, 'wb') as output:
+            output.write(data)
+
+def _element_name(dtype):
+    if dtype.kind == 'b':
+        return 'bool'
+    if dtype.kind in 'OUS':
+        return _string_type
+    return _dtype_names[f'{dtype.kind}{dtype.itemsize}']
+
+def _cpp_literal_to_python(text):
+    ''' Converts the body of a C++ initializer list generated by sos_xeus_cling to a Python value '''
+    def replace(m):
+        token = m.group(0)
+        if token.startswith('"'):
+            return token
+        return {'{': '(', '}': ')', 'true': 'True', 'false': 'False'}.get(token, token)
+    text = re.sub(r'-?std::numeric_limits<[\w ]+>::quiet_NaN\(\)', '"nan"', text)
+    text = re.sub(r'(-?)std::numeric_limits<[\w ]+>::infinity\(\)', r'"\1inf"', text)
+    text = re.sub(r'(\d)L\b', r'\1', text)
+    return ast.literal_eval('[' + re.sub(r'"(?:\\.|[^"\\])*"|[{}]|\btrue\b|\bfalse\b', replace, text) + ']')
+
+_vector_expression = r'sos_read_strings\(sos_read_buffer<char>\("[^"]+"\), sos_read_buffer<[\w: ]+>\("[^"]+"\)\)|sos_read_buffer<[\w: ]+>\("[^"]+"\)|std::vector<[\w: ]+>\{ .*? \}'
+
+def _vector_value(text):
+    ''' Returns the values of a std::vector expression generated by sos_xeus_cling '''
+    strings = re.match(r'sos_read_strings\(sos_read_buffer<char>\("([^"]+)"\), (.+)\)$', text)
+    if strings:
+        with open(strings.group(1), 'rb') as column:
+            data = column.read()
+        offsets = _vector_value(strings.group(2)).tolist()
+        return np.array([data[start:stop].decode() for start, stop in zip(offsets[:-1], offsets[1:])], dtype=object)
+    m = re.match(r'sos_read_buffer<([\w: ]+)>\("([^"]+)"\)|std::vector<([\w: ]+)>\{ (.*?) \}$', text)
+    dtype = _numpy_types.get(m.group(1) or m.group(3), np.uint64)
+    if m.group(2):
+        return np.fromfile(m.group(2), dtype=np.uint8 if dtype is np.bool_ else dtype).astype(dtype)
+    return np.array(_cpp_literal_to_python(m.group(4)), dtype=dtype)
+
+def _digest(value):
+    if isinstance(value, np.ndarray):
+        return hashlib.md5(value.tobytes() + repr(value.shape).encode()).hexdigest()
+    if isinstance(value, pd.DataFrame):
+        return hashlib.md5(value.to_numpy().tobytes()).hexdigest()
+    return hashlib.md5(repr(value).encode()).hexdigest()
+
+class CppVariable:
+    ''' Value held by the fake C++ kernel, with the C++ container kind it was declared as '''
+
+    #nested vectors hold (offsets, values) in CSR form, sparse matrices (format, shape, data, indices, indptr or row, col)
+    def __init__(self, kind, value, cpp_type=None, key_type=None, value_type=None):
+        self.kind = kind
+        self.value = value
+        self.cpp_type = cpp_type
+        self.key_type = key_type
+        self.value_type = value_type
+
+    def manifest(self, name):
+        entry = {'name': name}
+        if self.kind == 'scalar':
+            entry.update(type=self.cpp_type, element_type=None, shape=[len(self.value)] if self.cpp_type == _string_type else None)
+        elif self.kind == 'map':
+            entry.update(type=f'{self.cpp_type or "std::map"}<{self.key_type}, {self.value_type}, std::less<{self.key_type}> >', element_type=f'std::pair<{self.key_type} const, {self.value_type}>',
+                key_type=self.key_type, value_type=self.value_type, shape=[len(self.value)])
+        elif self.kind == 'vector':
+            element = _element_name(self.value.dtype)
+            entry.update(type=f'std::vector<{element}, std::allocator<{element}> >', element_type=element, shape=list(self.value.shape))
+        elif self.kind == 'nested':
+            element = _element_name(self.value[1].dtype)
+            inner = f'std::vector<{element}, std::allocator<{element}> >'
+            entry.update(type=f'std::vector<{inner}, std::allocator<{inner}> >', element_type=inner, shape=[len(self.value[0]) - 1])
+        elif self.kind == 'sparse':
+            form = self.value[0]
+            entry.update(type=f'sos_coo_matrix<{_cpp_names[self.cpp_type]}>' if form == 'coo' else f'sos_compressed_matrix<{_cpp_names[self.cpp_type]}, {str(form == "csr").lower()}>',
+                element_type=None, shape=None)
+        elif self.kind == 'xarray':
+            element = _element_name(self.value.dtype)
+            entry.update(type=f'xt::xarray_container<xt::uvector<{element}, xsimd::aligned_allocator<{element}, 16ul> >, (xt::layout_type)1, xt::svector<unsigned long, 4ul, std::allocator<unsigned long>, true>, xt::xtensor_expression_tag>',
+                element_type=element, shape=list(self.value.shape))
+        elif self.kind == 'xframe':
+            element = _element_name(self.value.values.dtype)
+            entry.update(type=f'xf::xvariable_container<xf::xcoordinate<xf::fstring, xtl::variant<int, long, xf::fstring>, unsigned long>, xt::xarray_container<xt::uvector<{element}> > >',
+                element_type=element, shape=list(self.value.shape))
+        entry['size'] = int(np.prod(entry['shape'])) if entry['shape'] is not None else None
+        return entry
+
+    def flat(self):
+        if self.kind == 'xframe':
+            return self.value.to_numpy().reshape(-1)
+        if self.kind == 'nested':
+            return self.value[1]
+        if self.kind == 'map':
+            return [el for item in self.value.items() for el in item]
+        return np.asarray(self.value).reshape(-1)
+
+def _format_record(value):
+    ''' Formats a value the way std::cout with the precision set by cpp_init_statements would, followed by the record separator '''
+    if isinstance(value, (bool, np.bool_)):
+        text = '1' if value else '0'
+    elif isinstance(value, (float, np.floating)):
+        text = f'{float(value):.16g}'
+    elif isinstance(value, str):
+        text = value.replace('\\', '\\\\').replace('\x1e', '\\e')
+    else:
+        text = str(value)
+    return text + '\x1e'
+
+class FakeKernelManager:
+    ''' Kernel manager of the fake subkernel, counting interrupts '''
+
+    def __init__(self):
+        self.interrupts = 0
+        self.interrupted = threading.Event()
+
+    def interrupt_kernel(self):
+        self.interrupts += 1
+        self.interrupted.set()
+
+class FakeSoSKernel:
+    ''' Fake SoS kernel whose get_response and run_cell emulate a xeus-cling subkernel '''
+
+    def __init__(self, variables=None, recording=None, evaluate=True, message_size=4096):
+        #variables: name -> CppVariable already defined in C++
+        self.variables = dict(variables or {})
+        self.registry = {}
+        self.evaluate = evaluate
+        self.message_size = message_size
+        self.replay = {}
+        if recording is not None:
+            with open(recording) as traffic:
+                for method, code, response, outputs in json.load(traffic):
+                    self.replay[(method, normalize_code(code))] = (response, outputs)
+        self.warnings = []
+        self.cells = 0
+        self.bytes_received = 0
+        #code of all cells, in the order received, and the kernel that was current for each
+        self.history = []
+        self.history_kernels = []
+        self.kernel = 'SoS'
+        #number of following get_response calls that lose their output
+        self.lost_responses = 0
+        #text printed to stderr and stdout before the output of the following get_response calls, one entry per call
+        self.stderr = []
+        self.stdout = []
+        #number of following cells that hang until the subkernel is interrupted
+        self.hanging_cells = 0
+        self.KM = FakeKernelManager()
+
+    def _hang(self):
+        if not self.hanging_cells:
+            return False
+        self.hanging_cells -= 1
+        self.KM.interrupted.wait()
+        self.KM.interrupted.clear()
+        return True
+
+    def _replay(self, method, code):
+        ''' Returns the recorded response to code, after writing the files and segments the recorded cell wrote under their new names '''
+        response, outputs = self.replay[(method, normalize_code(code))]
+        paths = _temp_path.findall(code)
+        for index, data in outputs:
+            _write_output(paths[index], base64.b64decode(data))
+        return response
+
+    def switch_kernel(self, kernel, in_vars=None, ret_vars=None, kernel_name=None, language=None, color=None):
+        self.kernel = kernel
+
+    def warn(self, message):
+        self.warnings.append(message)
+
+    def run_cell(self, code, silent, store_history, on_error=None):
+        self.cells += 1
+        self.history.append(code)
+        self.history_kernels.append(self.kernel)
+        self.bytes_received += len(code)
+        if self._hang():
+            return
+        if ('run_cell', normalize_code(code)) in self.replay:
+            return self._replay('run_cell', code)
+        self._execute(code)
+
+    def get_response(self, statement, msg_types, name=None):
+        self.cells += 1
+        self.history.append(statement)
+        self.history_kernels.append(self.kernel)
+        self.bytes_received += len(statement)
+        if self._hang():
+            return []
+        if ('get_response', normalize_code(statement)) in self.replay:
+            return self._replay('get_response', statement)
+        if self.lost_responses:
+            self.lost_responses -= 1
+            return []
+        try:
+            output = self._execute(statement)
+        except KeyError as e:
+            #xeus-cling reports compile errors such as undeclared names with an error message
+            return [['error', {'ename': 'Interpreter Error', 'evalue': f'use of undeclared identifier {e}', 'traceback': []}]] if 'error' in msg_types else []
+        output = (self.stdout.pop(0) if self.stdout else '') + output
+        warning = self.stderr.pop(0) if self.stderr else ''
+        stderr = [['stream', {'name': 'stderr', 'text': warning}]] if warning else []
+        #xeus splits long outputs into several stream messages
+        return stderr + [['stream', {'name': 'stdout', 'text': output[i:i + self.message_size]}] for i in range(0, len(output), self.message_size)]
+
+    def _declare(self, name, variable):
+        self.variables[name] = variable
+
+    def _execute(self, code):
+        output = []
+        for m in re.finditer(r'(?:^|; ?|\s)(int|long int|float|double|long double|bool|std::string) (\w+) = (.*?);(?= |$)', code):
+            value = _cpp_literal_to_python(m.group(3))[0] if self.evaluate else None
+            self._declare(m.group(2), CppVariable('scalar', value, _cpp_names[m.group(1)]))
+        for m in re.finditer(r'std::vector<(.+?)> (\w+) = \{ (.*?) \};', code):
+            values = np.array(_cpp_literal_to_python(m.group(3)), dtype=_numpy_types.get(m.group(1), object)) if self.evaluate else None
+            self._declare(m.group(2), CppVariable('vector', values))
+        for m in re.finditer(rf'std::vector<std::vector<(.+?)>> (\w+) = sos_from_csr<.+?>\(({_vector_expression}), ({_vector_expression})\);', code):
+            self._declare(m.group(2), CppVariable('nested', (_vector_value(m.group(3)), _vector_value(m.group(4)))))
+        for m in re.finditer(rf'sos_(csr|csc|coo)_matrix<(.+?)> (\w+)\{{ (\d+), (\d+), ({_vector_expression}), ({_vector_expression}), ({_vector_expression}) \}};', code):
+            self._declare(m.group(3), CppVariable('sparse', (m.group(1), (int(m.group(4)), int(m.group(5))), _vector_value(m.group(6)), _vector_value(m.group(7)), _vector_value(m.group(8))), m.group(2)))
+        for m in re.finditer(rf'std::(map|unordered_map)<(.+?), (.+?)> (\w+) = sos_zip_\1\(({_vector_expression}), ({_vector_expression})\);', code):
+            value = dict(zip(_vector_value(m.group(5)).tolist(), _vector_value(m.group(6)).tolist())) if self.evaluate else None
+            self._declare(m.group(4), CppVariable('map', value, f'std::{m.group(1)}', key_type=_cpp_names[m.group(2)], value_type=_cpp_names[m.group(3)]))
+        for m in re.finditer(r'xt::xarray<(.+?)> (\w+) = \{ (.*?) \}; \2\.reshape\(\{ (.*?) \}\);', code):
+            values = np.array(_cpp_literal_to_python(m.group(3)), dtype=_numpy_types[m.group(1)]).reshape(_cpp_literal_to_python(m.group(4))) if self.evaluate else None
+            self._declare(m.group(2), CppVariable('xarray', values))
+        for m in re.finditer(r'xt::xarray<(.+?)> (\w+) = xt::load_npy<.+?>\("(.+?)"\);', code):
+            self._declare(m.group(2), CppVariable('xarray', np.load(m.group(3)) if self.evaluate else None))
+        for m in re.finditer(r'auto (\w+) = sos_shm_adapt<(.+?)>\("/(\w+)", \{ (.*?) \}\);', code):
+            segment = shared_memory.SharedMemory(name=m.group(3))
+            shape = _cpp_literal_to_python(m.group(4))
+            self._declare(m.group(1), CppVariable('xarray', np.ndarray(shape, dtype=_numpy_types[m.group(2)], buffer=segment.buf).copy()))
+            segment.close()
+        for m in re.finditer(r'xt::xarray<(.+?)> (\w+) = xt::empty<.+?>\(\{ (.*?) \}\);', code):
+            self._declare(m.group(2), CppVariable('xarray', np.empty(_cpp_literal_to_python(m.group(3)), dtype=_numpy_types[m.group(1)]) if self.evaluate else None))
+        for m in re.finditer(r'sos_set_column\((\w+), (\d+), (?:xt::load_npy<.+?>\("(.+?)"\)|xt::xarray<.+?>\(\{ (.*?) \}\))\);', code):
+            if self.evaluate:
+                self.variables[m.group(1)].value[:, int(m.group(2))] = np.load(m.group(3)) if m.group(3) else _cpp_literal_to_python(m.group(4))
+        for m in re.finditer(r'auto (\w+) = xf::variable\(\1_data,', code):
+            name = m.group(1)
+            if not self.evaluate:
+                self._declare(name, CppVariable('xframe', None))
+                continue
+            rows = re.search(rf'auto {name}_x_axis = (?:xf::axis\(\{{ (.*?) \}}\)|sos_axis\(({_vector_expression})\));', code)
+            rows = _cpp_literal_to_python(rows.group(1)) if rows.group(1) is not None else _vector_value(rows.group(2)).tolist()
+            cols = _cpp_literal_to_python(re.search(rf'auto {name}_y_axis = xf::axis\(\{{ (.*?) \}}\);', code).group(1))
+            self._declare(name, CppVariable('xframe', pd.DataFrame(self.variables[f'{name}_data'].value, index=rows, columns=cols)))
+        for m in re.finditer(r'sos_load_chunk\((\w+), (\d+), "(.+?)"\);', code):
+            if not self.evaluate:
+                continue
+            flat = self.variables[m.group(1)].value.reshape(-1)
+            chunk = np.fromfile(m.group(3), dtype=flat.dtype)
+            flat[int(m.group(2)):int(m.group(2)) + chunk.size] = chunk
+        for m in re.finditer(r'sos_register_transfer\("(\w+)", (\w+)\);', code):
+            self.registry[m.group(1)] = (self.variables[m.group(2)].kind, _digest(self.variables[m.group(2)].value))
+        for m in re.finditer(r'sos_transfer_valid\("(\w+)", (\w+)\)', code):
+            variable = self.variables[m.group(2)]
+            output.append('1' if self.registry.get(m.group(1)) == (variable.kind, _digest(variable.value)) else '0')
+        if 'sos_manifest_entry' in code:
+            output.append(json.dumps([self.variables[name].manifest(name) for name in re.findall(r'sos_manifest_entry\("(\w+)", \w+\);', code)]))
+        for m in re.finditer(r'sos_print_record\((\w+)\);', code):
+            output.append(_format_record(self.variables[m.group(1)].value))
+        for m in re.finditer(r'sos_print_elements\((\w+)\);', code):
+            output.append(''.join(_format_record(el) for el in self.variables[m.group(1)].flat()))
+        for m in re.finditer(r'sos_print_offsets\((\w+)\);', code):
+            output.append(''.join(_format_record(offset) for offset in self.variables[m.group(1)].value[0].tolist()))
+        for m in re.finditer(r'sos_print_labels\((\w+), (\d)\);', code):
+            frame = self.variables[m.group(1)].value
+            output.append(''.join(_format_record(label) for label in (frame.index if m.group(2) == '0' else frame.columns)))
+        for m in re.finditer(r'dump_npy_buffer\("(.+?)", (?:xt::view\((\w+)\.data\(\), xt::all\(\), (\d+)\)|(\w+))\);', code):
+            if m.group(2):
+                np.save(m.group(1), self.variables[m.group(2)].value.iloc[:, int(m.group(3))].to_numpy())
+            else:
+                np.save(m.group(1), self.variables[m.group(4)].value)
+        for m in re.finditer(r'dump_npy_buffer\("(.+?)", xt::view\((\w+), ((?:xt::range\(\d+, \d+\)(?:, )?)+)\)\);', code):
+            np.save(m.group(1), self.variables[m.group(2)].value[tuple(slice(int(a), int(b)) for a, b in re.findall(r'xt::range\((\d+), (\d+)\)', m.group(3)))])
+        for m in re.finditer(r'sos_shm_export\("/(\w+)", (\w+)\);', code):
+            value = np.ascontiguousarray(self.variables[m.group(2)].value)
+            segment = shared_memory.SharedMemory(name=m.group(1), create=True, size=value.nbytes)
+            np.ndarray(value.shape, dtype=value.dtype, buffer=segment.buf)[...] = value
+            segment.close()
+        for m in re.finditer(r'sos_dump_csr\((\w+), "(.+?)", "(.+?)"\);', code):
+            offsets, values = self.variables[m.group(1)].value
+            offsets.astype(np.uint64).tofile(m.group(2))
+            values.tofile(m.group(3))
+        for m in re.finditer(r'sos_dump_map\((\w+), "(.+?)", "(.+?)", "(.+?)", "(.+?)"\);', code):
+            variable = self.variables[m.group(1)]
+            for column, cpp_type, path, offsets_path in ((list(variable.value), variable.key_type, *m.group(2, 3)), (list(variable.value.values()), variable.value_type, *m.group(4, 5))):
+                if cpp_type == _string_type:
+                    encoded = [x.encode() for x in column]
+                    with open(path, 'wb') as out:
+                        out.write(b''.join(encoded))
+                    np.cumsum([0] + [len(x) for x in encoded], dtype=np.uint64).tofile(offsets_path)
+                else:
+                    np.asarray(column, dtype=_put_dtypes[cpp_type]).tofile(path)
+        for m in re.finditer(r'sos_dump_sparse\((\w+), "(.+?)", "(.+?)", "(.+?)"\);', code):
+            form, shape, *arrays = self.variables[m.group(1)].value
+            for array, path, dtype in zip(arrays, m.groups()[1:], (None, np.uint64, np.uint64)):
+                array.astype(dtype or array.dtype).tofile(path)
+            output.append(''.join(_format_record(x) for x in shape))
+        for m in re.finditer(r'sos_dump_chunk\((\w+), (\d+), (\d+), "(.+?)"\);', code):
+            start, count = int(m.group(2)), int(m.group(3))
+            self.variables[m.group(1)].value.reshape(-1)[start:start + count].tofile(m.group(4))
+        return ''.join(output)
+
+class RecordingSoSKernel:
+    ''' Wraps a real SoS kernel and records get_response and run_cell traffic for replay by FakeSoSKernel '''
+
+    def __init__(self, sos_kernel):
+        self.sos_kernel = sos_kernel
+        self.traffic = []
+
+    def __getattr__(self, name):
+        return getattr(self.sos_kernel, name)
+
+    def _record(self, method, code, call):
+        #files and segments written by the cell, such as binary %put dumps, are recorded by their position in the code
+        paths = _temp_path.findall(code)
+        existing = {path for path in paths if _read_output(path) is not None}
+        response = call()
+        outputs = []
+        for index, path in enumerate(paths):
+            data = _read_output(path) if path not in existing else None
+            if data is not None:
+                outputs.append([index, base64.b64encode(data).decode()])
+        self.traffic.append([method, code, response, outputs])
+        return response
+
+    def run_cell(self, code, silent, store_history, on_error=None):
+        return self._record('run_cell', code, lambda: self.sos_kernel.run_cell(code, silent, store_history, on_error=on_error))
+
+    def get_response(self, statement, msg_types, name=None):
+        return self._record('get_response', statement, lambda: self.sos_kernel.get_response(statement, msg_types))
+
+    def save(self, filename):
+        with open(filename, 'w') as traffic:
+            json.dump(self.traffic, traffic)
@@ -106,6 +106,185 @@ class TestCppKernel(unittest.TestCase):
             execute(kc=kc, code="%use sos")
             wait_for_idle(kc)
 
+    def testPythonToCppMixedDataframe(self):
+        with sos_kernel() as kc:
+            iopub = kc.iopub_channel
+            execute(kc=kc, code = '''
+                import pandas as pd
+                mixed_df = pd.DataFrame({'A': [1, 2, 3], 'B': [0.5, 1.5, 2.5], 'C': [True, False, True]})
+                ''')
+            wait_for_idle(kc)
+            execute(kc=kc, code='%use C++14')
+            wait_for_idle(kc)
+            execute(kc=kc, code='%get mixed_df')
+            wait_for_idle(kc)
+
+            execute(kc=kc, code='std::cout << mixed_df.size() << " " << mixed_df.data()(2, 0) << " " << mixed_df.data()(1, 1);')
+            stdout, _ = assemble_output(iopub)
+            self.assertEqual(stdout.strip(),'9 3 1.5')
+
+            execute(kc=kc, code="%use sos")
+            wait_for_idle(kc)
+
+    def testPythonToCppLargeArray(self):
+        with sos_kernel() as kc:
+            iopub = kc.iopub_channel
+            execute(kc=kc, code = '''
+                import numpy as np
+                large_array = np.arange(200000, dtype=np.int64).reshape(1000, 200)
+                ''')
+            wait_for_idle(kc)
+            execute(kc=kc, code='%use C++14')
+            wait_for_idle(kc)
+            execute(kc=kc, code='%get large_array')
+            wait_for_idle(kc)
+
+            execute(kc=kc, code='std::cout << large_array.size() << " " << large_array(999, 199);')
+            stdout, _ = assemble_output(iopub)
+            self.assertEqual(stdout.strip(),'200000 199999')
+
+            execute(kc=kc, code="%use sos")
+            wait_for_idle(kc)
+
+    def testSharedMemoryArrayRoundTrip(self):
+        with sos_kernel() as kc:
+            iopub = kc.iopub_channel
+            execute(kc=kc, code = '''
+                import numpy as np
+                from sos_xeus_cling.kernel import sos_xeus_cling
+                sos_xeus_cling.shared_memory = True
+                shm_array = np.arange(20000, dtype=np.int64).reshape(100, 200)
+                ''')
+            wait_for_idle(kc)
+            execute(kc=kc, code='%use C++14')
+            wait_for_idle(kc)
+            execute(kc=kc, code='%get shm_array')
+            wait_for_idle(kc)
+            execute(kc=kc, code='shm_array(99, 199) = -1; std::cout << shm_array.size() << " " << shm_array(99, 198);')
+            stdout, _ = assemble_output(iopub)
+            self.assertEqual(stdout.strip(),'20000 19998')
+            execute(kc=kc, code='%put shm_array')
+            wait_for_idle(kc)
+            execute(kc=kc, code='%use sos')
+            wait_for_idle(kc)
+
+            execute(kc=kc, code='print(shm_array.shape, shm_array[99, 199], shm_array[0, 1])')
+            stdout, _ = assemble_output(iopub)
+            self.assertEqual(stdout.strip(),'(100, 200) -1 1')
+            execute(kc=kc, code='sos_xeus_cling.shared_memory = False')
+            wait_for_idle(kc)
+
+    def testRaggedListRoundTrip(self):
+        with sos_kernel() as kc:
+            iopub = kc.iopub_channel
+            execute(kc=kc, code = '''
+                ragged = [[1, 2, 3], [], [4]]
+                ''')
+            wait_for_idle(kc)
+            execute(kc=kc, code='%use C++14')
+            wait_for_idle(kc)
+            execute(kc=kc, code='%get ragged')
+            wait_for_idle(kc)
+            execute(kc=kc, code='std::cout << ragged.size() << " " << ragged[0].size() << " " << ragged[1].size() << " " << ragged[2][0];')
+            stdout, _ = assemble_output(iopub)
+            self.assertEqual(stdout.strip(),'3 3 0 4')
+            execute(kc=kc, code='''
+                std::vector<std::vector<double>> events = {{0.5}, {1.5, 2.5}};
+                ''')
+            wait_for_idle(kc)
+            execute(kc=kc, code='%put events')
+            wait_for_idle(kc)
+            execute(kc=kc, code='%use sos')
+            wait_for_idle(kc)
+
+            execute(kc=kc, code='print([row.tolist() for row in events])')
+            stdout, _ = assemble_output(iopub)
+            self.assertEqual(stdout.strip(),'[[0.5], [1.5, 2.5]]')
+
+    def testSparseMatrixRoundTrip(self):
+        with sos_kernel() as kc:
+            iopub = kc.iopub_channel
+            execute(kc=kc, code = '''
+                import scipy.sparse
+                sparse_matrix = scipy.sparse.csr_matrix(([1.5, 2.5], [2, 0], [0, 1, 2]), shape=(2, 1000000))
+                ''')
+            wait_for_idle(kc)
+            execute(kc=kc, code='%use C++14')
+            wait_for_idle(kc)
+            execute(kc=kc, code='%get sparse_matrix')
+            wait_for_idle(kc)
+            execute(kc=kc, code='std::cout << sparse_matrix.cols << " " << sparse_matrix.data.size() << " " << sparse_matrix.indices[0];')
+            stdout, _ = assemble_output(iopub)
+            self.assertEqual(stdout.strip(),'1000000 2 2')
+            execute(kc=kc, code='''
+                sos_coo_matrix<double> coo{ 3, 3, {1.0, 2.0}, {0, 2}, {1, 2} };
+                ''')
+            wait_for_idle(kc)
+            execute(kc=kc, code='%put coo')
+            wait_for_idle(kc)
+            execute(kc=kc, code='%use sos')
+            wait_for_idle(kc)
+
+            execute(kc=kc, code='print(coo.format, coo.shape, coo.toarray().tolist())')
+            stdout, _ = assemble_output(iopub)
+            self.assertEqual(stdout.strip(),'coo (3, 3) [[0.0, 1.0, 0.0], [0.0, 0.0, 0.0], [0.0, 0.0, 2.0]]')
+
+    def testUnorderedMapRoundTrip(self):
+        with sos_kernel() as kc:
+            iopub = kc.iopub_channel
+            execute(kc=kc, code = '''
+                from sos_xeus_cling.kernel import sos_xeus_cling
+                sos_xeus_cling.unordered_maps = True
+                big_dict = {f'key{i}': i * 0.5 for i in range(20000)}
+                ''')
+            wait_for_idle(kc)
+            execute(kc=kc, code='%use C++14')
+            wait_for_idle(kc)
+            execute(kc=kc, code='%get big_dict')
+            wait_for_idle(kc)
+            execute(kc=kc, code='big_dict["key\\"quoted"] = -1; std::cout << type(big_dict).substr(0, 18) << " " << big_dict.size() << " " << big_dict["key19999"];')
+            stdout, _ = assemble_output(iopub)
+            self.assertEqual(stdout.strip(),'std::unordered_map 20001 9999.5')
+            execute(kc=kc, code='%put big_dict')
+            wait_for_idle(kc)
+            execute(kc=kc, code='%use sos')
+            wait_for_idle(kc)
+
+            execute(kc=kc, code='print(len(big_dict), big_dict["key3"], big_dict[\'key"quoted\'])')
+            stdout, _ = assemble_output(iopub)
+            self.assertEqual(stdout.strip(),'20001 1.5 -1.0')
+            execute(kc=kc, code='sos_xeus_cling.unordered_maps = False')
+            wait_for_idle(kc)
+
+    def testLazyArrayPut(self):
+        with sos_kernel() as kc:
+            iopub = kc.iopub_channel
+            execute(kc=kc, code = '''
+                import numpy as np
+                from sos_xeus_cling.kernel import sos_xeus_cling
+                sos_xeus_cling.lazy_put_threshold = 1000
+                ''')
+            wait_for_idle(kc)
+            execute(kc=kc, code='%use C++14')
+            wait_for_idle(kc)
+            execute(kc=kc, code='''
+                #include "xtensor/xarray.hpp"
+                #include "xtensor/xbuilder.hpp"
+                xt::xarray<double> lazy_array = xt::arange<double>(20000);
+                lazy_array.reshape({100, 200});
+                ''')
+            wait_for_idle(kc)
+            execute(kc=kc, code='%put lazy_array')
+            wait_for_idle(kc)
+            execute(kc=kc, code='%use sos')
+            wait_for_idle(kc)
+
+            execute(kc=kc, code='print(type(lazy_array).__name__, lazy_array.shape, lazy_array[99, 199], lazy_array[1, 2:5].tolist(), np.asarray(lazy_array).sum())')
+            stdout, _ = assemble_output(iopub)
+            self.assertEqual(stdout.strip(),'CppArrayProxy (100, 200) 19999.0 [202.0, 203.0, 204.0] 199990000.0')
+            execute(kc=kc, code='sos_xeus_cling.lazy_put_threshold = None')
+            wait_for_idle(kc)
+
     def testCpptoPythonScalars(self):
         with sos_kernel() as kc:
             iopub = kc.iopub_channel
@@ -113,6 +292,7 @@ class TestCppKernel(unittest.TestCase):
             execute(kc=kc, code='%use C++14')
             wait_for_idle(kc)
             execute(kc=kc, code='''
+                #include "xtensor/xarray.hpp"
                 int i = 1;
                 short int si = 32;
                 long int li = 2000000000;
@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Konstantin Taletskiy
+# Distributed under the terms of the MIT License.
+
+# Transfer tests against test/fake_kernel.py, a local stand-in for the xeus-cling kernel, so they run without cling.
+# Like sos-notebook, every %get and %put uses a new sos_xeus_cling object.
+
+import gc
+import os
+import threading
+import time
+import unittest
+import tracemalloc
+import weakref
+from tempfile import TemporaryDirectory
+import numpy as np
+import pandas as pd
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+from sos.utils import env
+from sos_xeus_cling.kernel import sos_xeus_cling, transfer_stats, TransferStats, CppRequestError, CppExecutionError
+from fake_kernel import FakeSoSKernel, RecordingSoSKernel, CppVariable, shared_memory
+
+class Unreadable(list):
+    ''' Sequence that fails to serialize '''
+
+    def __getitem__(self, index):
+        raise ValueError('unreadable')
+
+class FailingDeclaration(sos_xeus_cling):
+    ''' Module whose declaration of variable bad fails after writing a transfer file '''
+
+    def _Cpp_declare_command_string(self, name, obj):
+        if name == 'bad':
+            with open(self._transfer_file('.bin'), 'wb') as dump:
+                dump.write(bytes(100000))
+            raise ValueError('unreadable')
+        return super()._Cpp_declare_command_string(name, obj)
+
+class TestTransfer(unittest.TestCase):
+
+    def testHeadersIncludedWhereNeeded(self):
+        kernel = FakeSoSKernel({'arr': CppVariable('xarray', np.arange(3.0))})
+        #also after a restart that did not read init_statements
+        for i in range(2):
+            sos_xeus_cling(kernel, 'xcpp14').put_vars(['arr'])
+        dumps = [code for code in kernel.history if 'dump_npy_buffer' in code]
+        self.assertEqual(len(dumps), 2)
+        self.assertTrue(all(code.startswith('#include') and 'xtensor_utils.hpp' in code for code in dumps))
+        #cells that use no xtensor helper do not include it
+        self.assertEqual(sum('xtensor_utils.hpp' in code for code in kernel.history), 2)
+
+    def testRepeatedGetSkipped(self):
+        kernel = FakeSoSKernel()
+        env.sos_dict.set('table', np.arange(100))
+        sos_xeus_cling(kernel, 'xcpp14').init_statements
+        sos_xeus_cling(kernel, 'xcpp14').get_vars(['table'])
+        sos_xeus_cling(kernel, 'xcpp14').get_vars(['table'])
+        self.assertEqual(sum('xt::xarray<int>' in code for code in kernel.history), 1)
+        #changed in SoS, redeclared in C++, or lost by a restart of the subkernel
+        env.sos_dict.set('table', np.arange(101))
+        sos_xeus_cling(kernel, 'xcpp14').get_vars(['table'])
+        kernel.variables['table'] = CppVariable('vector', np.arange(101))
+        sos_xeus_cling(kernel, 'xcpp14').get_vars(['table'])
+        kernel.registry.clear()
+        sos_xeus_cling(kernel, 'xcpp14').get_vars(['table'])
+        sos_xeus_cling(kernel, 'xcpp14').init_statements
+        sos_xeus_cling(kernel, 'xcpp14').get_vars(['table'])
+        self.assertEqual(sum('xt::xarray<int>' in code for code in kernel.history), 5)
+        self.assertTrue(any('sos_transfer_valid("table", table)' in code for code in kernel.history))
+
+    def testGetCacheBoundedByBytes(self):
+        kernel = FakeSoSKernel()
+        env.sos_dict.set('first', np.zeros(1000))
+        env.sos_dict.set('second', np.ones(1000))
+        module = sos_xeus_cling(kernel, 'xcpp14')
+        module.get_cache_max_bytes = 12000
+        module.get_vars(['first'])
+        module.get_vars(['second'])
+        self.assertEqual(list(module._state.get_cache), ['second'])
+
+    def testLargeListNotPickledForCache(self):
+        pickled = []
+
+        class Tracked(list):
+            def __reduce_ex__(self, protocol):
+                pickled.append(self)
+                return super().__reduce_ex__(protocol)
+
+        env.sos_dict.set('big', Tracked(range(100000)))
+        module = sos_xeus_cling(FakeSoSKernel(), 'xcpp14')
+        module.get_cache_max_bytes = 10000
+        module.get_vars(['big'])
+        self.assertEqual(pickled, [])
+        self.assertEqual(list(module._state.get_cache), [])
+
+    def testDataFrameIntegersKeptExact(self):
+        kernel = FakeSoSKernel()
+        env.sos_dict.set('frame', pd.DataFrame({'A': [20000001, 3], 'B': [0.5, 1.0]}))
+        sos_xeus_cling(kernel, 'xcpp14').get_vars(['frame'])
+        self.assertEqual(int(kernel.variables['frame'].value.iloc[0, 0]), 20000001)
+
+    def testDataFrameIndexSentAsBuffer(self):
+        frames = {'numbered': pd.DataFrame({'A': np.arange(20000.0)}, index=np.arange(20000) * 3),
+            'labelled': pd.DataFrame({'A': np.arange(20000.0)}, index=[f'row{i}' for i in range(20000)])}
+        for name, frame in frames.items():
+            env.sos_dict.set(name, frame)
+        kernel = FakeSoSKernel()
+        sos_xeus_cling(kernel, 'xcpp14').get_vars(list(frames))
+        #the declarations do not grow with the number of rows
+        self.assertLess(max(len(code) for code in kernel.history), 2000)
+        for name, frame in frames.items():
+            self.assertEqual(kernel.variables[name].value.index.tolist(), frame.index.tolist())
+
+    def testChunkedGetMemory(self):
+        env.sos_dict.set('large', np.linspace(1.0, 2.0, 1000000) * 1e300)
+        module = sos_xeus_cling(FakeSoSKernel(evaluate=False), 'xcpp14')
+        module.chunk_size = 1 << 20
+        module.get_cache_size = 0
+        tracemalloc.start()
+        module.get_vars(['large'])
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        #a few blocks of chunk_size bytes instead of copies of the 8 MB array
+        self.assertLess(peak, 4 * module.chunk_size)
+
+    def testTextPutAcrossMessages(self):
+        strings = np.array(['a\\b', 'c\x1ed', '', 'several words'], dtype=object)
+        kernel = FakeSoSKernel({'numbers': CppVariable('vector', np.arange(-5, 100)), 'strings': CppVariable('vector', strings)}, message_size=3)
+        module = sos_xeus_cling(kernel, 'xcpp14')
+        module.binary_put = False
+        result = module.put_vars(['numbers', 'strings'])
+        np.testing.assert_array_equal(result['numbers'], np.arange(-5, 100))
+        self.assertEqual(result['strings'].tolist(), strings.tolist())
+
+    def testHelpersInstantiatedOncePerKernel(self):
+        kernel = FakeSoSKernel({'v': CppVariable('vector', np.arange(3)), 'w': CppVariable('vector', np.arange(5))})
+        for names in (['v'], ['w', 'v']):
+            module = sos_xeus_cling(kernel, 'xcpp14')
+            module.binary_put = False
+            result = module.put_vars(names)
+        np.testing.assert_array_equal(result['w'], np.arange(5))
+        instantiations = [code for code in kernel.history if code.startswith('template void sos_print_elements<std::vector<long')]
+        self.assertEqual(len(instantiations), 1)
+        #a restarted subkernel has to instantiate it again
+        sos_xeus_cling(kernel, 'xcpp14').init_statements
+        module = sos_xeus_cling(kernel, 'xcpp14')
+        module.binary_put = False
+        module.put_vars(['v'])
+        self.assertEqual(sum(code.startswith('template void sos_print_elements<') for code in kernel.history), 2)
+
+    def testBinaryPutExact(self):
+        vector = np.array([0.1, -2.5, 1e-30], dtype=np.float32)
+        array = np.arange(12, dtype=np.float64).reshape(3, 4) / 7
+        kernel = FakeSoSKernel({'vector': CppVariable('vector', vector), 'array': CppVariable('xarray', array)})
+        result = sos_xeus_cling(kernel, 'xcpp14').put_vars(['vector', 'array'])
+        self.assertEqual(result['vector'].dtype, np.float32)
+        np.testing.assert_array_equal(result['vector'], vector)
+        np.testing.assert_array_equal(result['array'], array)
+        #manifest, then one cell dumping both arrays
+        self.assertEqual(kernel.cells, 2)
+
+    def testArrayDeclarations(self):
+        module = sos_xeus_cling(FakeSoSKernel(), 'xcpp14')
+        self.assertEqual(module._Cpp_declare_command_string('a', [1, 2, 3]), 'std::vector<int> a = { 1, 2, 3 };')
+        self.assertEqual(module._Cpp_declare_command_string('a', [1, 2 ** 40]), 'std::vector<long int> a = { 1, 1099511627776 };')
+        self.assertEqual(module._Cpp_declare_command_string('a', (True, False)), 'std::vector<bool> a = { true, false };')
+        self.assertEqual(module._Cpp_declare_command_string('a', np.array([0.5, np.nan, -np.inf])),
+            'xt::xarray<float> a = { 0.5, std::numeric_limits<double>::quiet_NaN(), -std::numeric_limits<double>::infinity() }; a.reshape({ 3 });')
+        self.assertEqual(module._Cpp_declare_command_string('a', np.array([[1e300], [1.0]])), 'xt::xarray<double> a = { 1e+300, 1.0 }; a.reshape({ 2,1 });')
+        self.assertIsNone(module._Cpp_declare_command_string('a', np.zeros((3, 0))))
+        self.assertIsNone(module._Cpp_declare_command_string('a', np.empty((3, 0), dtype=object)))
+
+    @unittest.skipIf(sparse is None, 'sparse matrices require scipy')
+    def testSparseRoundTripExact(self):
+        matrix = sparse.random(20, 30, density=0.2, format='csr', random_state=0) / 3
+        kernel = FakeSoSKernel()
+        module = sos_xeus_cling(kernel, 'xcpp14')
+        module.get_cache_size = 0
+        for form in ('csr', 'csc', 'coo'):
+            env.sos_dict.set('matrix', matrix.asformat(form))
+            module.get_vars(['matrix'])
+            self.assertIn(f'sos_{form}_matrix<double> matrix', kernel.history[-1])
+            result = module.put_vars(['matrix'])['matrix']
+            self.assertEqual((result.format, result.dtype), (form, np.float64))
+            np.testing.assert_array_equal(result.toarray(), matrix.toarray())
+
+    def testPipelinedGet(self):
+        kernel = FakeSoSKernel()
+        for i in range(5):
+            env.sos_dict.set(f'var{i}', Unreadable([1]) if i == 2 else np.arange(i + 1))
+        module = sos_xeus_cling(kernel, 'xcpp14')
+        module.get_workers = 2
+        module.get_cache_size = 0
+        module.get_vars([f'var{i}' for i in range(5)])
+        self.assertEqual([name for name in kernel.variables], ['var0', 'var1', 'var3', 'var4'])
+        np.testing.assert_array_equal(kernel.variables['var4'].value, np.arange(5))
+        self.assertEqual(len(kernel.warnings), 1)
+        self.assertIn('var2', kernel.warnings[0])
+
+    def testPipelinedGetFailureNotRecorded(self):
+        for name in ('first', 'bad', 'last'):
+            env.sos_dict.set(name, np.arange(10))
+        module = FailingDeclaration(FakeSoSKernel(), 'xcpp14')
+        module.get_workers = 2
+        module.get_cache_size = 0
+        module.collect_stats = True
+        transfer_stats.clear()
+        try:
+            module.get_vars(['first', 'bad', 'last'])
+            records = [record.as_dict() for record in transfer_stats.records]
+        finally:
+            transfer_stats.clear()
+        #the file written for the failed declaration is removed by its worker, and counted in no transfer
+        self.assertEqual([record['name'] for record in records], ['first', 'bad', 'last'])
+        self.assertTrue(all(record['bytes'] < 1000 for record in records))
+
+    def testRequestRetriedWithBackoff(self):
+        kernel = FakeSoSKernel({'i': CppVariable('scalar', 1, 'int')})
+        kernel.lost_responses = 3
+        module = sos_xeus_cling(kernel, 'xcpp14')
+        module.request_backoff = 0.01
+        start = time.monotonic()
+        self.assertEqual(module.put_vars(['i']), {'i': 1})
+        #waits of 0.01, 0.02 and 0.04 seconds
+        self.assertGreaterEqual(time.monotonic() - start, 0.07)
+        self.assertEqual(kernel.lost_responses, 0)
+
+    def testRequestGivesUp(self):
+        kernel = FakeSoSKernel({'i': CppVariable('scalar', 1, 'int')})
+        kernel.lost_responses = 100
+        module = sos_xeus_cling(kernel, 'xcpp14')
+        module.request_backoff = 0.001
+        module.request_retries = 4
+        with self.assertRaisesRegex(CppRequestError, 'and 4 retries'):
+            module._request('sos_print_record(i);')
+        kernel.lost_responses = 100
+        module.request_backoff = 0.1
+        module.request_timeout = 0.25
+        start = time.monotonic()
+        with self.assertRaisesRegex(CppRequestError, 'after 0.2'):
+            module._request('sos_print_record(i);')
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def testRequestErrorNotRetried(self):
+        kernel = FakeSoSKernel()
+        with self.assertRaisesRegex(CppExecutionError, 'undeclared'):
+            sos_xeus_cling(kernel, 'xcpp14')._request('sos_print_record(missing);')
+        self.assertEqual(kernel.cells, 1)
+
+    def testRequestCancelled(self):
+        kernel = FakeSoSKernel({'i': CppVariable('scalar', 1, 'int')})
+        kernel.lost_responses = 100
+        module = sos_xeus_cling(kernel, 'xcpp14')
+        module.request_backoff = 10
+        threading.Timer(0.1, module.cancel).start()
+        start = time.monotonic()
+        with self.assertRaisesRegex(CppRequestError, 'cancelled'):
+            module._request('sos_print_record(i);')
+        self.assertLess(time.monotonic() - start, 1)
+
+    def testHangingRequestGivesUp(self):
+        kernel = FakeSoSKernel({'i': CppVariable('scalar', 1, 'int')})
+        kernel.hanging_cells = 1
+        module = sos_xeus_cling(kernel, 'xcpp14')
+        module.request_timeout = 0.2
+        start = time.monotonic()
+        self.assertEqual(module.put_vars(['i']), {})
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertIn('No response from C++ after 0.2', kernel.warnings[0])
+        self.assertEqual(kernel.KM.interrupts, 1)
+        #the interrupted kernel takes the next request
+        self.assertEqual(module.put_vars(['i']), {'i': 1})
+
+    def testHangingCellGivesUp(self):
+        env.sos_dict.set('arr', np.arange(3.0))
+        kernel = FakeSoSKernel()
+        kernel.hanging_cells = 1
+        module = sos_xeus_cling(kernel, 'xcpp14')
+        module.request_timeout = 0.2
+        module.get_vars(['arr'])
+        self.assertIn('No response from C++', kernel.warnings[0])
+        self.assertEqual(kernel.KM.interrupts, 1)
+        module.get_vars(['arr'])
+        np.testing.assert_array_equal(kernel.variables['arr'].value, np.arange(3.0))
+
+    def testHangingRequestCancelled(self):
+        kernel = FakeSoSKernel({'i': CppVariable('scalar', 1, 'int')})
+        kernel.hanging_cells = 1
+        module = sos_xeus_cling(kernel, 'xcpp14')
+        threading.Timer(0.1, module.cancel).start()
+        start = time.monotonic()
+        with self.assertRaisesRegex(CppRequestError, 'cancelled'):
+            module._request('sos_print_record(i);')
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(kernel.KM.interrupts, 1)
+
+    def testPutWithUndeclaredName(self):
+        kernel = FakeSoSKernel({'i': CppVariable('scalar', 1, 'int'), 'v': CppVariable('vector', np.arange(3))})
+        result = sos_xeus_cling(kernel, 'xcpp14').put_vars(['i', 'missing', 'v'])
+        self.assertEqual(list(result), ['i', 'v'])
+        self.assertEqual(len(kernel.warnings), 1)
+        self.assertIn('missing', kernel.warnings[0])
+
+    def testPutIgnoresStderr(self):
+        kernel = FakeSoSKernel({'i': CppVariable('scalar', 1, 'int'), 'v': CppVariable('vector', np.arange(3))})
+        kernel.stderr = ['warning: unused variable\n'] * 10
+        env.sos_dict.set('arr', np.arange(3.0))
+        module = sos_xeus_cling(kernel, 'xcpp14')
+        module.get_vars(['arr'])
+        module.get_vars(['arr'])
+        #the cache check is not confused by the warning
+        self.assertEqual(sum('xt::xarray<' in code for code in kernel.history), 1)
+        result = module.put_vars(['i', 'v'])
+        self.assertEqual(result['i'], 1)
+        np.testing.assert_array_equal(result['v'], np.arange(3))
+        self.assertEqual(kernel.warnings, [])
+
+    def testPutWithUndecodableOutput(self):
+        kernel = FakeSoSKernel({'i': CppVariable('scalar', 1, 'int'), 'j': CppVariable('scalar', 2, 'int')})
+        #extra output breaks the manifest of both variables, and then the batch of their values
+        kernel.stdout = ['debug', '', '', 'debug\x1e']
+        self.assertEqual(sos_xeus_cling(kernel, 'xcpp14').put_vars(['i', 'j']), {'i': 1, 'j': 2})
+        self.assertEqual(kernel.warnings, [])
+        kernel.stdout = ['', 'debug\x1e', 'debug\x1e']
+        self.assertEqual(sos_xeus_cling(kernel, 'xcpp14').put_vars(['i', 'j']), {'j': 2})
+        self.assertEqual(len(kernel.warnings), 1)
+        self.assertIn('Failed to put variable i', kernel.warnings[0])
+
+    @unittest.skipIf(shared_memory is None, 'multiprocessing.shared_memory requires Python 3.8')
+    def testSharedMemoryPutOutlivesModule(self):
+        array = np.arange(10000.0).reshape(100, 100)
+        module = sos_xeus_cling(FakeSoSKernel({'shared': CppVariable('xarray', array)}), 'xcpp14')
+        module.shared_memory = True
+        shared = module.put_vars(['shared'])['shared']
+        #sos-notebook drops the module after every magic
+        del module
+        gc.collect()
+        np.testing.assert_array_equal(shared, array)
+        row = shared[5]
+        base = weakref.ref(shared.base)
+        del shared
+        gc.collect()
+        np.testing.assert_array_equal(row, array[5])
+        del row
+        gc.collect()
+        self.assertIsNone(base())
+
+    def testRecordedTrafficReplayed(self):
+        variables = {'array': CppVariable('xarray', np.arange(12.0).reshape(3, 4)), 'names': CppVariable('map', {1.0: 1.5, 2.0: 2.5}, key_type='double', value_type='double'),
+            'count': CppVariable('scalar', 3, 'int')}
+        for use_shared_memory in ((False, True) if shared_memory is not None else (False,)):
+            recorder = RecordingSoSKernel(FakeSoSKernel(variables))
+            module = sos_xeus_cling(recorder, 'xcpp14')
+            module.shared_memory = use_shared_memory
+            expected = module.put_vars(['array', 'names', 'count'])
+            with TemporaryDirectory() as tmp:
+                recorder.save(os.path.join(tmp, 'traffic.json'))
+                #the replaying kernel holds no variables, so every cell is answered from the recording
+                kernel = FakeSoSKernel(recording=os.path.join(tmp, 'traffic.json'))
+            module = sos_xeus_cling(kernel, 'xcpp14')
+            module.shared_memory = use_shared_memory
+            result = module.put_vars(['array', 'names', 'count'])
+            self.assertEqual(kernel.warnings, [])
+            self.assertEqual(result.keys(), expected.keys())
+            np.testing.assert_array_equal(result['array'], expected['array'])
+            self.assertEqual(result['names'], expected['names'])
+            self.assertEqual(result['count'], 3)
+
+    def testProxyFetchesFromItsKernel(self):
+        array = np.arange(20000.0).reshape(100, 200)
+        kernel = FakeSoSKernel({'lazy': CppVariable('xarray', array)})
+        module = sos_xeus_cling(kernel, 'xcpp14')
+        module.lazy_put_threshold = 1000
+        proxy = module.put_vars(['lazy'])['lazy']
+        self.assertEqual((proxy.shape, proxy.dtype), ((100, 200), np.float64))
+        #indexed in a SoS cell after another subkernel was used
+        kernel.kernel = 'R'
+        np.testing.assert_array_equal(proxy[10:20, 5], array[10:20, 5])
+        np.testing.assert_array_equal(proxy[12, 5], array[12, 5])
+        self.assertEqual(kernel.history_kernels[-1], 'xcpp14')
+        self.assertEqual(sum('xt::view' in code for code in kernel.history), 1)
+        self.assertEqual(kernel.kernel, 'R')
+
+    def testBatchedPutRecordedPerVariable(self):
+        kernel = FakeSoSKernel({'i': CppVariable('scalar', 1, 'int'), 'a': CppVariable('xarray', np.arange(6.0)), 'b': CppVariable('vector', np.arange(4))})
+        module = sos_xeus_cling(kernel, 'xcpp14')
+        module.collect_stats = True
+        transfer_stats.clear()
+        try:
+            self.assertEqual(set(module.put_vars(['i', 'a', 'b'])), {'i', 'a', 'b'})
+            records = [record.as_dict() for record in transfer_stats.records]
+        finally:
+            transfer_stats.clear()
+        self.assertEqual([record['name'] for record in records], ['i', 'a', 'b'])
+        self.assertEqual({record['batch'] for record in records}, {3})
+        #the bytes and time of the batch are shared equally, not counted once per variable
+        self.assertLessEqual(max(record['bytes'] for record in records) - min(record['bytes'] for record in records), 2)
+        self.assertEqual(len({record['total'] for record in records}), 1)
+        self.assertEqual({record['round_trips'] for record in records}, {kernel.cells})
+
+    def testTransfersRecordedPerVariable(self):
+        env.sos_dict.set('first', np.arange(3.0))
+        env.sos_dict.set('second', 'text')
+        kernel = FakeSoSKernel({'i': CppVariable('scalar', 1, 'int'), 'v': CppVariable('vector', np.arange(3))})
+        module = sos_xeus_cling(kernel, 'xcpp14')
+        module.collect_stats = True
+        #vectors fall back to one cell per variable without binary dumps
+        module.binary_put = False
+        transfer_stats.clear()
+        try:
+            module.get_vars(['first', 'second'])
+            module.put_vars(['i', 'v'])
+            records = [record.as_dict() for record in transfer_stats.records]
+        finally:
+            transfer_stats.clear()
+        self.assertEqual([(record['direction'], record['name']) for record in records], [('get', 'first'), ('get', 'second'), ('put', 'i'), ('put', 'v')])
+        #every variable carries its share of the hashes and of the manifest
+        self.assertTrue(all('hash' in record['phases'] and 'execute' in record['phases'] for record in records[:2]))
+        #the vector also instantiates its print helper
+        self.assertEqual([record['round_trips'] for record in records[2:]], [2, 3])
+        self.assertEqual([record['batch'] for record in records[2:]], [1, 1])
+
+    def testTransferStatsBounded(self):
+        stats = TransferStats()
+        for i in range(stats.max_records + 5):
+            stats.add(i)
+        self.assertEqual(len(stats.records), stats.max_records)
+        self.assertEqual(stats.records[0], 5)
+
+if __name__ == '__main__':
+    unittest.main()